@@ -13,6 +13,7 @@ class ActionHandlerError(Exception):
 class ActionHandler:
 
     def __init__(self, **kwargs):
+        kwargs.setdefault('persistent', True)
         self.data = {}
         self.using = kwargs.get('using')
         self.tx_exporter = TransactionExporter(
@@ -51,7 +52,7 @@ class ActionHandler:
     def pending_filenames(self):
         return [
             obj.filename for obj in self.tx_exporter.history_model.objects.using(
-                self.using).filter(sent=False).order_by('-created')
+                self.using).filter(sent=False).order_by('created', 'batch_id')
         ]
 
     @property
@@ -78,13 +79,12 @@ class ActionHandler:
 
     def _export_batch(self):
         try:
-            batch = self.tx_exporter.export_batch()
+            batches = self.tx_exporter.export_batches()
         except TransactionExporterError as e:
             raise ActionHandlerError(e) from e
         else:
-            if batch:
-                self.data.update(batch_id=batch.batch_id)
-                self.pending_filenames.append(batch.filename)
+            if batches:
+                self.data.update(batch_id=batches[-1].batch_id)
 
     def _send_files(self):
         try:
@@ -29,6 +29,8 @@ class AppConfig(DjangoAppConfig):
         settings.MEDIA_ROOT, 'transactions', 'archive')
     log_folder = os.path.join(
         settings.MEDIA_ROOT, 'transactions', 'log')
+    quarantine_folder = os.path.join(
+        settings.MEDIA_ROOT, 'transactions', 'quarantine')
 
     def ready(self):
         sys.stdout.write(f'Loading {self.verbose_name} ...\n')
@@ -42,6 +44,6 @@ class AppConfig(DjangoAppConfig):
         for folder in [
             self.pending_folder, self.usb_incoming_folder, self.outgoing_folder,
                 self.incoming_folder, self.archive_folder, self.tmp_folder,
-                self.log_folder]:
+                self.log_folder, self.quarantine_folder]:
             if not os.path.exists(folder):
                 os.makedirs(folder)
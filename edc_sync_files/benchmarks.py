@@ -0,0 +1,175 @@
+import os
+import resource
+import socket
+import sys
+import tempfile
+import time
+import uuid
+
+from datetime import timedelta
+
+from edc_base.utils import get_utcnow
+from edc_sync.models import OutgoingTransaction
+
+from .transaction import JSONDumpFile, TransactionExporterBatch
+
+BENCHMARK_TX_NAME = 'edc_sync_files.benchmark'
+
+
+def make_outgoing_transactions(count=None, payload_size=None, using=None,
+                               consumed=None, age=None, batch_size=None):
+    """Bulk creates `count` synthetic outgoing transactions with
+    a random payload of `payload_size` bytes.
+
+    If `consumed`, the transactions are created as already exported
+    and `age` days old, as on a mature client.
+    """
+    using = using or 'default'
+    batch_size = batch_size or 1000
+    producer = f'{socket.gethostname()}-{using}'
+    created = get_utcnow() - timedelta(days=age or 0)
+    objs = []
+    for _ in range(0, count):
+        timestamp = created.strftime('%Y%m%d%H%M%S%f')
+        objs.append(OutgoingTransaction(
+            tx=os.urandom(payload_size or 0),
+            tx_name=BENCHMARK_TX_NAME,
+            tx_pk=uuid.uuid4(),
+            producer=producer,
+            action='I',
+            timestamp=timestamp,
+            using=using,
+            created=created,
+            modified=created,
+            batch_id='benchmark' if consumed else None,
+            prev_batch_id='benchmark' if consumed else None,
+            is_consumed_server=bool(consumed)))
+        if len(objs) == batch_size:
+            OutgoingTransaction.objects.using(using).bulk_create(objs)
+            objs = []
+    if objs:
+        OutgoingTransaction.objects.using(using).bulk_create(objs)
+
+
+def peak_rss():
+    """Returns the peak resident set size of this process in MB.
+    """
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return maxrss / 1024 / 1024
+    return maxrss / 1024
+
+
+class NullStream:
+
+    """A text stream that discards what is written but counts
+    the characters.
+    """
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, s):
+        self.size += len(s)
+
+
+class StageResult:
+
+    def __init__(self, stage=None, seconds=None, rows=None, size=None):
+        self.stage = stage
+        self.seconds = seconds
+        self.rows = rows
+        self.size = size
+        self.peak_rss = peak_rss()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(stage={self.stage})'
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0
+
+    @property
+    def mb_per_second(self):
+        if self.size is None or not self.seconds:
+            return None
+        return self.size / 1024 / 1024 / self.seconds
+
+
+class ExportBenchmark:
+
+    """Times each stage of exporting `rows` synthetic outgoing
+    transactions with a payload of `payload_size` bytes.
+
+    Stages are `ExportBatch.open`, serialization (to a null stream),
+    `JSONDumpFile.write` and `ExportBatch.close`.
+
+    Note: peak RSS is the peak for the process up to the end of
+    each stage.
+    """
+
+    batch_cls = TransactionExporterBatch
+    json_file_cls = JSONDumpFile
+
+    def __init__(self, rows=None, payload_size=None, using=None,
+                 compression=None, export_path=None):
+        self.compression = compression
+        self.export_path = export_path or tempfile.mkdtemp()
+        self.payload_size = payload_size
+        self.rows = rows
+        self.using = using
+
+    def run(self):
+        """Returns a list of StageResults.
+        """
+        results = []
+        make_outgoing_transactions(
+            count=self.rows, payload_size=self.payload_size, using=self.using)
+
+        start = time.perf_counter()
+        batch = self.batch_cls(
+            using=self.using, full_scan=True, compression=self.compression)
+        results.append(StageResult(
+            stage='open', seconds=time.perf_counter() - start,
+            rows=batch.count))
+
+        stream = NullStream()
+        start = time.perf_counter()
+        self.json_file_cls(batch=batch, path=self.export_path).dump(stream=stream)
+        results.append(StageResult(
+            stage='serialize', seconds=time.perf_counter() - start,
+            rows=batch.count, size=stream.size))
+
+        json_file = self.json_file_cls(batch=batch, path=self.export_path)
+        start = time.perf_counter()
+        json_file.write()
+        results.append(StageResult(
+            stage='write', seconds=time.perf_counter() - start,
+            rows=json_file.count, size=json_file.manifest.size))
+
+        rows = batch.count
+        start = time.perf_counter()
+        batch.close()
+        results.append(StageResult(
+            stage='close', seconds=time.perf_counter() - start,
+            rows=rows))
+        return results
+
+
+def open_latency(table_sizes=None, pending=None, using=None):
+    """Yields (table size, full scan seconds, watermark seconds) for
+    opening a batch of `pending` transactions as the table grows.
+    """
+    for size in table_sizes:
+        count = OutgoingTransaction.objects.using(using).count()
+        if size > count:
+            make_outgoing_transactions(
+                count=size - count, using=using, consumed=True, age=30)
+        timings = []
+        for full_scan in [True, False]:
+            make_outgoing_transactions(count=pending, using=using)
+            start = time.perf_counter()
+            batch = TransactionExporterBatch(using=using, full_scan=full_scan)
+            timings.append(time.perf_counter() - start)
+            batch.close()
+        yield size, timings[0], timings[1]
@@ -1,9 +1,13 @@
 ACTION = 'action'
 CONFIRM_BATCH = 'confirm_batch'
 CONSUME = 'consume'
+DELETE = 'D'
 ERROR = 'error'
 EXPORT_BATCH = 'export_batch'
+GZIP = 'gzip'
+INSERT = 'I'
 LOCALHOST = 'localhost'
+MANIFEST_SUFFIX = '.manifest'
 NETWORK = 'network'
 OTHER = 'other'
 PENDING_FILES = 'pending_files'
@@ -13,3 +17,4 @@ REMOTE = 'remote'
 SEND_FILES = 'send_files'
 SUCCESS = 'success'
 TRANSACTION = 'transaction'
+XZ = 'xz'
@@ -1,6 +1,8 @@
+from .deduplicating_queue import DeduplicatingQueueMixin
 from .deserialize_transactions_file_queue import DeserializeTransactionsFileQueue
 from .exceptions import TransactionsFileQueueError
 from .file_queue_handlers import (
     RegexFileQueueHandlerIncoming, RegexFileQueueHandlerPending)
+from .import_deserialize_transactions_file_queue import ImportDeserializeTransactionsFileQueue
 from .incoming_transactions_file_queue import IncomingTransactionsFileQueue
-from .process_queue import process_queue
+from .process_queue import process_queue, process_queue_concurrently
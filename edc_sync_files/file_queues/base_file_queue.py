@@ -1,25 +1,63 @@
+import logging
 import os
 import re
+import threading
 
+from django.db.utils import InterfaceError, OperationalError
 from queue import Queue
 
+from ..patterns import transaction_file_regexes, transaction_filename_producer_regex
 from ..transaction import FileArchiver, FileArchiverError
 from .exceptions import TransactionsFileQueueError
+from .quarantine import Quarantine
+from .queue_journal import PENDING, QueueJournal, QueueJournalError
+
+logger = logging.getLogger('edc_sync_files')
 
 
 class BaseFileQueue(Queue):
 
+    """A queue of files.
+
+    An item that fails with a transient error, e.g. the database is
+    unavailable, is put back in the queue after a delay that doubles
+    with each attempt. Otherwise, or after `max_attempts`, the file
+    is moved to the quarantine folder, if any.
+
+    If `journal_path`, items are recorded in a durable journal and
+    a reloaded queue resumes pending items from the journal while
+    the source folder is scanned in the background.
+    """
+
+    backoff = 5
     file_archiver_cls = FileArchiver
+    journal_cls = QueueJournal
+    max_attempts = 5
+    quarantine_cls = Quarantine
+    transient_errors = (InterfaceError, OperationalError)
 
-    def __init__(self, src_path=None, dst_path=None, **kwargs):
+    def __init__(self, src_path=None, dst_path=None, quarantine_path=None,
+                 max_attempts=None, backoff=None, journal_path=None, **kwargs):
         super().__init__(maxsize=kwargs.get('maxsize', 0))
         self.src_path = src_path
         self.dst_path = dst_path
+        self.attempts = {}
+        self.held = None
+        self.local = threading.local()
+        self.scanned = None
+        self.backoff = backoff or self.backoff
+        self.max_attempts = max_attempts or self.max_attempts
+        self.quarantine = (
+            self.quarantine_cls(path=quarantine_path) if quarantine_path else None)
         try:
             self.file_archiver = self.file_archiver_cls(
                 src_path=src_path, dst_path=dst_path, **kwargs)
         except FileArchiverError as e:
             raise TransactionsFileQueueError(e) from e
+        try:
+            self.journal = self.journal_cls(path=journal_path) if journal_path else None
+        except QueueJournalError as e:
+            raise TransactionsFileQueueError(e) from e
 
     def __repr__(self):
         return f'{self.__class__.__name__}({self.src_path}, {self.dst_path})'
@@ -30,15 +68,202 @@ class BaseFileQueue(Queue):
     def next_task(self, item, **kwargs):
         pass
 
-    def reload(self, regexes=None, **kwargs):
+    def put(self, item, block=True, timeout=None):
+        if item is not None and self.hold(item):
+            return
+        if item is not None:
+            with self.mutex:
+                if self.scanned is not None:
+                    self.scanned.add(os.path.basename(item))
+            if self.journal:
+                self.journal.enqueued(item)
+        super().put(item, block=block, timeout=timeout)
+
+    def hold(self, item=None):
+        """Returns True if the item is held until the scan of the
+        source folder completes, see `startup`.
+
+        Items put by the scan are not held.
+        """
+        with self.mutex:
+            if self.held is None or getattr(self.local, 'scanning', False):
+                return False
+            self.held.append(item)
+            return True
+
+    def put_held(self):
+        """Puts the items held during the scan in timestamp order,
+        until none are left, then stops holding items.
+
+        Skips items the scan has already put.
+        """
+        while True:
+            with self.mutex:
+                held = self.held or []
+                self.held = [] if held else None
+            if not held:
+                return
+            held.sort(key=lambda item: self.sort_key(os.path.basename(item)))
+            for item in held:
+                with self.mutex:
+                    if os.path.basename(item) in (self.scanned or set()):
+                        continue
+                self.put(item)
+
+    def task_started(self, item=None):
+        if self.journal:
+            self.journal.started(item)
+
+    def task_succeeded(self, item=None):
+        self.attempts.pop(os.path.basename(item), None)
+        if self.journal:
+            self.journal.done(item)
+
+    def task_failed(self, item=None, exception=None):
+        """Retries the item later if the exception is transient,
+        otherwise quarantines the file.
+        """
+        filename = os.path.basename(item)
+        attempts = self.attempts.pop(filename, 0) + 1
+        retry = self.is_transient(exception) and attempts < self.max_attempts
+        if self.journal:
+            self.journal.failed(item, exception=exception, retry=retry)
+        if retry:
+            self.attempts[filename] = attempts
+            delay = self.backoff * 2 ** (attempts - 1)
+            logger.info(f'{self}: retrying {filename} in {delay}s. '
+                        f'Attempt {attempts} of {self.max_attempts}.')
+            timer = threading.Timer(delay, self.put, args=(item, ))
+            timer.daemon = True
+            timer.start()
+        else:
+            self.task_abandoned(item=item, exception=exception)
+            if self.quarantine:
+                self.quarantine.add(
+                    src_path=self.src_path, filename=filename,
+                    exception=exception, attempts=attempts, queue=self)
+
+    def task_abandoned(self, item=None, exception=None):
+        """Called when an item has failed and will not be retried.
+        """
+        pass
+
+    def is_transient(self, exception=None):
+        """Returns True if the exception, or any exception it was
+        raised from, is transient.
+        """
+        while exception:
+            if isinstance(exception, self.transient_errors):
+                return True
+            exception = exception.__cause__
+        return False
+
+    def partition_key(self, item=None):
+        """Returns the key of the batch chain the item belongs to,
+        the producer prefix of the filename, or the filename.
+
+        Items with the same key are processed in order.
+        """
+        filename = os.path.basename(item)
+        match = re.match(transaction_filename_producer_regex, filename)
+        return match.group('producer') if match else filename
+
+    def startup(self):
+        """Called by the observer before it starts watching and
+        before the queue is reloaded.
+
+        Items put from now until the scan completes, e.g. by the
+        watchdog handler, are held and put once the scan has put
+        the older files in the folder, so they do not overtake them.
+        Call `reload` after `startup`.
+        """
+        with self.mutex:
+            self.held = []
+            self.scanned = set()
+
+    def shutdown(self):
+        """Called by the observer after the queue is processed.
+
+        Prunes old finished items from the journal, if any.
+        """
+        if self.journal:
+            self.journal.prune()
+            self.journal.close()
+
+    def reload(self, regexes=None, background=None, **kwargs):
         """Reloads /path/to/filenames into the queue that match the regexes.
+
+        Defaults to regexes matching plain and compressed transaction files.
+
+        If journaled, first prunes the journal and puts the pending items
+        from the journal, marking as failed those whose file no longer
+        exists.
+        If `background` or journaled, scans the folder in a background
+        thread and returns the thread.
         """
+        if self.journal:
+            self.journal.prune()
+            self.local.scanning = True
+            try:
+                for item in self.journal.pending():
+                    if os.path.exists(
+                            os.path.join(self.src_path, os.path.basename(item))):
+                        self.put(item)
+                    else:
+                        self.journal.failed(
+                            item, exception='File no longer exists.', retry=False)
+            finally:
+                self.local.scanning = False
+        if background or self.journal:
+            thread = threading.Thread(
+                target=self.scan, kwargs=dict(regexes=regexes), daemon=True)
+            thread.start()
+            return thread
+        self.scan(regexes=regexes)
+        return None
+
+    def scan(self, regexes=None):
+        """Puts /path/to/filenames that match the regexes in the
+        order of the timestamp in the filename.
+
+        Skips items put since `startup` or the scan started and items
+        pending in the journal, if any. Then puts the items held since
+        `startup`, if any.
+        """
+        regexes = regexes or transaction_file_regexes
         combined = re.compile("(" + ")|(".join(regexes) + ")", re.I)
-        pending_files = os.listdir(self.src_path) or []
-        pending_files.sort()
-        for filename in pending_files:
-            if re.match(combined, filename):
+        with self.mutex:
+            if self.scanned is None:
+                self.scanned = set()
+        self.local.scanning = True
+        try:
+            with os.scandir(self.src_path) as entries:
+                filenames = [entry.name for entry in entries
+                             if entry.is_file() and combined.match(entry.name)]
+            filenames.sort(key=self.sort_key)
+            for filename in filenames:
+                with self.mutex:
+                    if filename in self.scanned:
+                        continue
+                if self.journal and self.journal.status(filename) in PENDING:
+                    continue
                 self.put(os.path.join(self.src_path, filename))
+        finally:
+            try:
+                self.put_held()
+            finally:
+                self.local.scanning = False
+                with self.mutex:
+                    self.scanned = None
+
+    def sort_key(self, filename=None):
+        """Returns a key to sort filenames by the timestamp in the
+        filename, then by filename.
+        """
+        match = re.match(transaction_filename_producer_regex, filename)
+        if match:
+            return (0, match.group('timestamp').ljust(20, '0'), filename)
+        return (1, '', filename)
 
     def archive(self, filename=None):
         try:
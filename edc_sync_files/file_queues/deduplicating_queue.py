@@ -0,0 +1,41 @@
+import logging
+import os
+
+logger = logging.getLogger('edc_sync_files')
+
+
+class DeduplicatingQueueMixin:
+
+    """A file queue mixin that ignores an item while an item with
+    the same filename is queued or in flight.
+
+    Declare before BaseFileQueue.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.queued = set()
+
+    def put(self, item, block=True, timeout=None):
+        if item is not None and self.hold(item):
+            return
+        if item is not None:
+            filename = os.path.basename(item)
+            with self.mutex:
+                if filename in self.queued:
+                    logger.info(f'{self}: ignored duplicate {filename}.')
+                    return
+                self.queued.add(filename)
+        super().put(item, block=block, timeout=timeout)
+
+    def release(self, item=None):
+        with self.mutex:
+            self.queued.discard(os.path.basename(item))
+
+    def task_succeeded(self, item=None):
+        self.release(item)
+        super().task_succeeded(item)
+
+    def task_failed(self, item=None, exception=None):
+        self.release(item)
+        super().task_failed(item, exception)
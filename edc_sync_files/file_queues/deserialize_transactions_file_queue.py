@@ -1,50 +1,76 @@
+import logging
 import os
 
 from django.core.serializers.base import DeserializationError
+from django.db import transaction
 
 from edc_sync.transaction import TransactionDeserializer, TransactionDeserializerError
 
 from ..transaction import TransactionImporterBatch
 from .base_file_queue import BaseFileQueue
+from .deduplicating_queue import DeduplicatingQueueMixin
 from .exceptions import TransactionsFileQueueError
 
+logger = logging.getLogger('edc_sync_files')
 
-class DeserializeTransactionsFileQueue(BaseFileQueue):
+
+class DeserializeTransactionsFileQueue(DeduplicatingQueueMixin, BaseFileQueue):
+
+    """A queue that deserializes the transactions of imported files.
+
+    If `group_size` is greater than 1, up to `group_size` queued files
+    from the same producer are deserialized together in one database
+    transaction, then closed and archived.
+    """
 
     batch_cls = TransactionImporterBatch
     tx_deserializer_cls = TransactionDeserializer
 
-    def __init__(self, history_model=None, allow_self=None, override_role=None, **kwargs):
+    def __init__(self, history_model=None, allow_self=None, override_role=None,
+                 group_size=None, **kwargs):
         super().__init__(**kwargs)
         self.history_model = history_model
         self.allow_self = allow_self
         self.override_role = override_role
+        self.group_size = group_size or 1
+        self.deferred = {}
 
     def next_task(self, item, raise_exceptions=None, **kwargs):
         """Deserializes all transactions for this batch and
         archives the file.
         """
-        filename = os.path.basename(item)
-        batch = self.get_batch(filename)
-        tx_deserializer = self.tx_deserializer_cls(
+        if self.group_size > 1:
+            return self.next_group_task(item)
+        self.deserialize(item)
+        self.archive(os.path.basename(item))
+
+    @property
+    def tx_deserializer(self):
+        return self.tx_deserializer_cls(
             allow_self=self.allow_self, override_role=self.override_role)
+
+    def deserialize(self, item=None, history=None, tx_deserializer=None):
+        """Deserializes all transactions for this batch and closes
+        the batch.
+        """
+        batch = self.get_batch(os.path.basename(item), history=history)
+        tx_deserializer = tx_deserializer or self.tx_deserializer
         try:
             tx_deserializer.deserialize_transactions(
                 transactions=batch.saved_transactions)
         except (DeserializationError, TransactionDeserializerError) as e:
             raise TransactionsFileQueueError(e) from e
-        else:
-            batch.close()
-            self.archive(filename)
+        batch.close()
 
-    def get_batch(self, filename=None):
+    def get_batch(self, filename=None, history=None):
         """Returns a batch instance given the filename.
         """
-        try:
-            history = self.history_model.objects.get(filename=filename)
-        except self.history_model.DoesNotExist as e:
-            raise TransactionsFileQueueError(
-                f'Batch history not found for \'{filename}\'.') from e
+        if history is None:
+            try:
+                history = self.history_model.objects.get(filename=filename)
+            except self.history_model.DoesNotExist as e:
+                raise TransactionsFileQueueError(
+                    f'Batch history not found for \'{filename}\'.') from e
         if history.consumed:
             raise TransactionsFileQueueError(
                 f'Batch closed for \'{filename}\'. Got consumed=True')
@@ -52,3 +78,154 @@ class DeserializeTransactionsFileQueue(BaseFileQueue):
         batch.batch_id = history.batch_id
         batch.filename = history.filename
         return batch
+
+    def next_group_task(self, item=None):
+        """Deserializes the transactions for this batch and queued
+        batches from the same producer in chain order in one database
+        transaction then archives the files.
+
+        If the group fails, it is rolled back and the items are
+        deserialized one by one so that only the failing item is
+        passed to `task_failed`. Items after a failed item are
+        deferred until it is put again, see `put`. Files are
+        archived after the database transaction commits.
+        """
+        group = self.get_histories([item] + self.take_group(item))
+        tx_deserializer = self.tx_deserializer
+        failed = None
+        try:
+            with transaction.atomic():
+                for queued, history in group:
+                    self.deserialize(queued, history, tx_deserializer)
+        except Exception as e:
+            if len(group) == 1:
+                raise
+            logger.info(f'{self}: group of {len(group)} failed. {e} '
+                        f'Deserializing one by one.')
+            failed = self.deserialize_singly(group, tx_deserializer)
+        self.group_done(
+            head=item, items=[queued for queued, _ in group], failed=failed)
+
+    def get_histories(self, items=None):
+        """Returns a list of (item, history) for the items in chain
+        order using one query.
+
+        The history is None if not found.
+        """
+        histories = {
+            history.filename: history
+            for history in self.history_model.objects.filter(
+                filename__in=[os.path.basename(item) for item in items])}
+        group = [(item, histories.get(os.path.basename(item))) for item in items]
+        return sorted(group, key=lambda x: (x[1] is None, x[1] and x[1].created))
+
+    def deserialize_singly(self, group=None, tx_deserializer=None):
+        """Deserializes the items one by one until one fails.
+
+        Returns a tuple of the index of the failed item and the
+        exception or None.
+        """
+        for index, (item, history) in enumerate(group):
+            try:
+                with transaction.atomic():
+                    self.deserialize(item, history, tx_deserializer)
+            except Exception as e:
+                return index, e
+        return None
+
+    def group_done(self, head=None, items=None, failed=None):
+        """Archives the deserialized items of a group, defers the
+        items after a failed item and marks the items other than
+        head as done.
+
+        Exceptions for the head item are raised for `process_queue`.
+        """
+        head_exception = None
+        for item in (items if failed is None else items[:failed[0]]):
+            try:
+                self.archive(os.path.basename(item))
+            except Exception as e:
+                head_exception = self.group_item_failed(item, head, e)
+            else:
+                if item != head:
+                    self.task_succeeded(item)
+                    self.task_done()
+        if failed:
+            index, exception = failed
+            self.defer(items[index], items[index + 1:], head=head)
+            head_exception = (
+                self.group_item_failed(items[index], head, exception) or head_exception)
+        if head_exception:
+            raise head_exception
+
+    def group_item_failed(self, item=None, head=None, exception=None):
+        """Returns the exception if item is the head, otherwise
+        marks the item as failed.
+        """
+        if item == head:
+            return exception
+        self.task_failed(item, exception)
+        self.task_done()
+        return None
+
+    def defer(self, item=None, successors=None, head=None):
+        """Holds the successors of a failed item until the item
+        is put again or abandoned.
+
+        The head item, if deferred, is marked done by `process_queue`.
+        """
+        if successors:
+            with self.mutex:
+                self.deferred[os.path.basename(item)] = successors
+            for successor in successors:
+                if successor != head:
+                    self.task_done()
+
+    def is_deferred(self, item=None):
+        with self.mutex:
+            return any(item in successors for successors in self.deferred.values())
+
+    def task_succeeded(self, item=None):
+        """Leaves a deferred head item queued and started until it
+        is put again, see `put_deferred`.
+        """
+        if not self.is_deferred(item):
+            super().task_succeeded(item)
+
+    def put(self, item, block=True, timeout=None):
+        super().put(item, block=block, timeout=timeout)
+        if item is not None:
+            self.put_deferred(item)
+
+    def put_deferred(self, item=None):
+        with self.mutex:
+            successors = self.deferred.pop(os.path.basename(item), [])
+        for successor in successors:
+            self.release(successor)
+            self.put(successor)
+
+    def task_abandoned(self, item=None, exception=None):
+        super().task_abandoned(item=item, exception=exception)
+        self.put_deferred(item)
+
+    def take_group(self, item=None):
+        """Removes and returns up to group_size - 1 queued items with
+        the same partition key as item.
+        """
+        key = self.partition_key(item)
+        taken = []
+        with self.mutex:
+            remaining = []
+            for queued in self.queue:
+                full = len(taken) >= self.group_size - 1
+                if queued is not None and not full and self.partition_key(queued) == key:
+                    taken.append(queued)
+                else:
+                    remaining.append(queued)
+            if taken:
+                self.queue.clear()
+                self.queue.extend(remaining)
+                self.not_full.notify(len(taken))
+        for queued in taken:
+            self.task_started(queued)
+        return taken
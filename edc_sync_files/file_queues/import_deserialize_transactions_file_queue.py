@@ -0,0 +1,76 @@
+import os
+
+from django.core.serializers.base import DeserializationError
+from django.db import transaction
+
+from edc_sync.transaction import TransactionDeserializer, TransactionDeserializerError
+
+from .exceptions import TransactionsFileQueueError
+from .incoming_transactions_file_queue import IncomingTransactionsFileQueue
+
+
+class ImportDeserializeTransactionsFileQueue(IncomingTransactionsFileQueue):
+
+    """A queue that imports and deserializes each file in one
+    stage then archives the file.
+
+    The import and deserialization of a file are saved in one
+    database transaction. Transactions inserted by the import are
+    deserialized from memory rather than queried again.
+    """
+
+    tx_deserializer_cls = TransactionDeserializer
+
+    def __init__(self, allow_self=None, override_role=None, **kwargs):
+        if kwargs.get('chunked') or kwargs.get('checkpoints'):
+            # chunks would be savepoints of the file's database
+            # transaction, not commits
+            raise TransactionsFileQueueError(
+                f'{self.__class__.__name__} does not support chunked or '
+                f'checkpointed imports.')
+        kwargs.update(keep_saved=True)
+        super().__init__(**kwargs)
+        self.allow_self = allow_self
+        self.override_role = override_role
+
+    def next_task(self, item, **kwargs):
+        """Imports and deserializes the next file in the queue
+        and archives the file.
+        """
+        filename = os.path.basename(item)
+        with transaction.atomic():
+            batch = self.import_batch(filename)
+            if batch:
+                self.deserialize_batch(batch)
+                batch.close()
+        if batch:
+            self.archive(filename)
+            self.release_parked(batch)
+        self.reorder_buffer.report_stale()
+
+    def deserialize_batch(self, batch=None):
+        """Deserializes the transactions inserted by the import.
+
+        TransactionDeserializer only queries `transactions` to refuse
+        this host's own transactions, unless allow_self. So the first
+        transaction is deserialized from a queryset to run that check
+        for the batch and the rest from the instances kept in memory.
+        If any rows already existed, the batch's queryset is used.
+        """
+        saved_objects = batch.saved_objects
+        if batch.existing or not saved_objects:
+            self.deserialize(transactions=batch.saved_transactions)
+        else:
+            self.deserialize(
+                transactions=batch.saved_transactions.filter(pk=saved_objects[0].pk))
+            if saved_objects[1:]:
+                self.deserialize(transactions=saved_objects[1:], allow_self=True)
+
+    def deserialize(self, transactions=None, allow_self=None):
+        tx_deserializer = self.tx_deserializer_cls(
+            allow_self=allow_self or self.allow_self,
+            override_role=self.override_role)
+        try:
+            tx_deserializer.deserialize_transactions(transactions=transactions)
+        except (DeserializationError, TransactionDeserializerError) as e:
+            raise TransactionsFileQueueError(e) from e
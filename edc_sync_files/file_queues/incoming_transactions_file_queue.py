@@ -1,29 +1,91 @@
 import os
+import threading
 
 from ..transaction import TransactionImporter, TransactionImporterError
+from ..transaction.batch_history_index import batch_history_index
+from ..transaction.transaction_importer import InvalidBatchSequence
 from .base_file_queue import BaseFileQueue
+from .deduplicating_queue import DeduplicatingQueueMixin
 from .exceptions import TransactionsFileQueueError
+from .reorder_buffer import ReorderBuffer
 
 
-class IncomingTransactionsFileQueue(BaseFileQueue):
+class IncomingTransactionsFileQueue(DeduplicatingQueueMixin, BaseFileQueue):
 
+    batch_history_index = batch_history_index
+    reorder_buffer_cls = ReorderBuffer
+    report_interval = 60
     tx_importer_cls = TransactionImporter
 
-    def __init__(self, src_path=None, raise_exceptions=None, **kwargs):
+    def __init__(self, src_path=None, raise_exceptions=None, max_parked_age=None,
+                 **kwargs):
         super().__init__(src_path=src_path, **kwargs)
         self.tx_importer = self.tx_importer_cls(import_path=src_path, **kwargs)
         self.raise_exceptions = raise_exceptions
+        self.reorder_buffer = self.reorder_buffer_cls(max_age=max_parked_age)
+        self.stopped = threading.Event()
+
+    def startup(self):
+        """Loads the batch history index so validating the batch
+        sequence does not query the history on the hot path.
+
+        Starts a thread that reports stale parked files every
+        `report_interval` seconds, including while the queue is
+        idle waiting for a missing predecessor.
+        """
+        super().startup()
+        self.batch_history_index.load()
+        self.stopped.clear()
+        threading.Thread(target=self.report_stale, daemon=True).start()
+
+    def shutdown(self):
+        self.stopped.set()
+        super().shutdown()
+        self.batch_history_index.clear()
+
+    def report_stale(self):
+        while not self.stopped.wait(self.report_interval):
+            self.reorder_buffer.report_stale()
 
     def next_task(self, item, **kwargs):
         """Calls import_batch for the next filename in the queue
         and "archives" the file.
 
         The archive folder is typically the folder for the deserializer queue.
+
+        A file that arrives before its predecessor is parked in the
+        reorder buffer and put back in the queue once the predecessor
+        is imported.
         """
         filename = os.path.basename(item)
+        batch = self.import_batch(filename)
+        if batch:
+            self.archive(filename)
+            self.release_parked(batch)
+        self.reorder_buffer.report_stale()
+
+    def task_abandoned(self, item=None, exception=None):
+        """Discards the import checkpoint, if any, of the failed file.
+        """
+        super().task_abandoned(item=item, exception=exception)
+        self.tx_importer.discard(filename=os.path.basename(item))
+
+    def import_batch(self, filename=None):
+        """Returns the imported batch or None if the file was parked.
+        """
         try:
-            self.tx_importer.import_batch(filename=filename)
+            return self.tx_importer.import_batch(filename=filename)
         except TransactionImporterError as e:
-            raise TransactionsFileQueueError(e) from e
-        else:
-            self.archive(filename)
+            if not isinstance(e.__cause__, InvalidBatchSequence):
+                raise TransactionsFileQueueError(e) from e
+            self.reorder_buffer.park(
+                filename=filename,
+                batch_id=e.__cause__.batch_id,
+                prev_batch_id=e.__cause__.prev_batch_id)
+        return None
+
+    def release_parked(self, batch=None):
+        """Puts files waiting for this batch back in the queue.
+        """
+        for parked_filename in self.reorder_buffer.release(batch.batch_id):
+            self.put(os.path.join(self.src_path, parked_filename))
@@ -1,8 +1,11 @@
 import os
 import logging
 import sys
+import threading
 
 from django.core.management.color import color_style
+from django.db import connections
+from queue import Queue
 
 logger = logging.getLogger('edc_sync_files')
 style = color_style()
@@ -11,7 +14,8 @@ style = color_style()
 def process_queue(queue=None, **kwargs):
     """Loops and waits on queue calling queue's `next_task` method.
 
-    If an exception occurs, log the error, log the exception, and break.
+    If an exception occurs, log the error, log the exception, pass
+    the item to the queue's `task_failed` method and continue.
     """
     while True:
         item = queue.get()
@@ -20,16 +24,136 @@ def process_queue(queue=None, **kwargs):
             logger.info(f'{queue}: exiting process queue.')
             break
         filename = os.path.basename(item)
+        queue.task_started(item)
         try:
             queue.next_task(item, **kwargs)
         except Exception as e:
-            queue.task_done()
             logger.warn(f'{queue}: item={filename}. {e}\n')
             logger.exception(e)
             sys.stdout.write(style.ERROR(
                 f'{queue}. item={filename}. {e}. Exception has been logged.\n'))
             sys.stdout.flush()
-            break
+            queue.task_failed(item, e)
         else:
             logger.info(f'{queue}: Successfully processed {filename}.\n')
+            queue.task_succeeded(item)
         queue.task_done()
+
+
+class QueueWorker(threading.Thread):
+
+    """A thread that calls the queue's `next_task` method for
+    items routed to it by the dispatcher.
+
+    As in `process_queue`, an exception is logged, the item passed to
+    the queue's `task_failed` method and the worker continues.
+    """
+
+    def __init__(self, queue=None, dispatcher=None, options=None, **kwargs):
+        super().__init__(daemon=True, **kwargs)
+        self.queue = queue
+        self.dispatcher = dispatcher
+        self.options = options or {}
+        self.items = Queue()
+
+    def run(self):
+        try:
+            while True:
+                item = self.items.get()
+                if item is None:
+                    break
+                filename = os.path.basename(item)
+                self.queue.task_started(item)
+                try:
+                    self.queue.next_task(item, **self.options)
+                except Exception as e:
+                    logger.warn(f'{self.queue}: {self.name} item={filename}. {e}\n')
+                    logger.exception(e)
+                    sys.stdout.write(style.ERROR(
+                        f'{self.queue}. item={filename}. {e}. '
+                        f'Exception has been logged.\n'))
+                    sys.stdout.flush()
+                    self.queue.task_failed(item, e)
+                else:
+                    logger.info(
+                        f'{self.queue}: {self.name} successfully processed {filename}.\n')
+                    self.queue.task_succeeded(item)
+                finally:
+                    self.dispatcher.done(item)
+                    self.queue.task_done()
+        finally:
+            connections.close_all()
+
+
+class QueueDispatcher:
+
+    """Routes items from the queue to a pool of workers by the
+    queue's partition key.
+
+    All items with the same key, e.g. a producer's batch chain, go
+    to the same worker while any are in flight, so each chain is
+    processed in order. A key with nothing in flight is assigned to
+    the least busy worker.
+    """
+
+    worker_cls = QueueWorker
+
+    def __init__(self, queue=None, workers=None, **options):
+        self.queue = queue
+        self.lock = threading.Lock()
+        self.assigned = {}
+        self.in_flight = {}
+        self.workers = [
+            self.worker_cls(
+                queue=queue, dispatcher=self, options=options,
+                name=f'{queue}-worker-{index}')
+            for index in range(0, workers or 1)]
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    def dispatch(self, item=None):
+        key = self.queue.partition_key(item)
+        with self.lock:
+            if not self.in_flight.get(key):
+                self.assigned[key] = min(
+                    self.workers, key=lambda worker: worker.items.qsize())
+            self.in_flight[key] = self.in_flight.get(key, 0) + 1
+            worker = self.assigned[key]
+            worker.items.put(item)
+
+    def done(self, item=None):
+        key = self.queue.partition_key(item)
+        with self.lock:
+            self.in_flight[key] -= 1
+            if not self.in_flight[key]:
+                del self.in_flight[key]
+                del self.assigned[key]
+
+    def stop(self):
+        for worker in self.workers:
+            worker.items.put(None)
+        for worker in self.workers:
+            worker.join()
+
+
+def process_queue_concurrently(queue=None, workers=None, **kwargs):
+    """Loops and waits on queue dispatching items to a pool of
+    `workers` threads, see QueueDispatcher.
+
+    Exits once the workers have finished when None is put in
+    the queue.
+    """
+    dispatcher = QueueDispatcher(queue=queue, workers=workers, **kwargs)
+    dispatcher.start()
+    try:
+        while True:
+            item = queue.get()
+            if item is None:
+                queue.task_done()
+                logger.info(f'{queue}: exiting process queue.')
+                break
+            dispatcher.dispatch(item)
+    finally:
+        dispatcher.stop()
@@ -0,0 +1,54 @@
+import json
+import logging
+import os
+import traceback
+
+from edc_base.utils import get_utcnow
+
+from ..constants import MANIFEST_SUFFIX
+
+logger = logging.getLogger('edc_sync_files')
+
+
+class Quarantine:
+
+    """A dead-letter folder for files that failed to process.
+
+    The file, and its manifest if any, is moved to the folder next
+    to an error record named `<filename>.error`.
+    """
+
+    error_suffix = '.error'
+
+    def __init__(self, path=None):
+        self.path = path
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.path})'
+
+    def add(self, src_path=None, filename=None, exception=None, attempts=None,
+            queue=None):
+        """Moves the file to quarantine and writes the error record.
+        """
+        for f in [f'{filename}{MANIFEST_SUFFIX}', filename]:
+            if os.path.exists(os.path.join(src_path, f)):
+                try:
+                    os.rename(os.path.join(src_path, f), os.path.join(self.path, f))
+                except OSError as e:
+                    logger.error(f'{self}: unable to quarantine {f}. Got {e}')
+        record = dict(
+            filename=filename,
+            src_path=src_path,
+            queue=str(queue),
+            error=str(exception),
+            exception=exception.__class__.__name__,
+            traceback=traceback.format_exception(
+                type(exception), exception, exception.__traceback__),
+            attempts=attempts,
+            quarantined_datetime=get_utcnow().isoformat())
+        try:
+            with open(os.path.join(self.path, f'{filename}{self.error_suffix}'), 'w') as f:
+                json.dump(record, f, indent=2)
+        except OSError as e:
+            logger.error(f'{self}: unable to write error record for {filename}. Got {e}')
+        logger.warning(f'{self}: quarantined {filename}. Got {exception}')
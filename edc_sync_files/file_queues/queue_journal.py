@@ -0,0 +1,124 @@
+import os
+import sqlite3
+import threading
+import time
+
+ENQUEUED = 'enqueued'
+IN_PROGRESS = 'in_progress'
+RETRYING = 'retrying'
+DONE = 'done'
+FAILED = 'failed'
+
+PENDING = (ENQUEUED, IN_PROGRESS, RETRYING)
+
+
+class QueueJournalError(Exception):
+    pass
+
+
+class QueueJournal:
+
+    """A durable, SQLite-backed, journal of the items of a file queue.
+
+    Records when each item is enqueued, started and finished and
+    its status so that a restarted queue resumes pending items
+    without scanning the source folder first.
+
+    Items done or failed more than `retention` seconds ago are
+    pruned, see `prune`.
+    """
+
+    retention = 7 * 24 * 60 * 60
+
+    def __init__(self, path=None, retention=None):
+        self.path = path
+        self.retention = retention or self.retention
+        self.lock = threading.Lock()
+        try:
+            self.connection = sqlite3.connect(
+                path, check_same_thread=False, isolation_level=None)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS item ('
+                'filename TEXT PRIMARY KEY, '
+                'item TEXT, '
+                'status TEXT, '
+                'attempts INTEGER DEFAULT 0, '
+                'enqueued REAL, '
+                'started REAL, '
+                'finished REAL, '
+                'error TEXT)')
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS item_status_enqueued '
+                'ON item (status, enqueued)')
+        except sqlite3.Error as e:
+            raise QueueJournalError(f'{e}. Got {path}') from e
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.path})'
+
+    def execute(self, sql=None, params=None):
+        with self.lock:
+            return self.connection.execute(sql, params or ()).fetchall()
+
+    def enqueued(self, item=None):
+        self.execute(
+            'INSERT INTO item (filename, item, status, enqueued) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT(filename) DO UPDATE SET '
+            'item=excluded.item, status=excluded.status, enqueued=excluded.enqueued, '
+            'started=NULL, finished=NULL',
+            (os.path.basename(item), item, ENQUEUED, time.time()))
+
+    def started(self, item=None):
+        self.execute(
+            'UPDATE item SET status=?, started=?, attempts=attempts + 1 '
+            'WHERE filename=?',
+            (IN_PROGRESS, time.time(), os.path.basename(item)))
+
+    def done(self, item=None):
+        self.execute(
+            'UPDATE item SET status=?, finished=?, error=NULL WHERE filename=?',
+            (DONE, time.time(), os.path.basename(item)))
+
+    def failed(self, item=None, exception=None, retry=None):
+        self.execute(
+            'UPDATE item SET status=?, finished=?, error=? WHERE filename=?',
+            (RETRYING if retry else FAILED, time.time(), str(exception),
+             os.path.basename(item)))
+
+    def status(self, item=None):
+        rows = self.execute(
+            'SELECT status FROM item WHERE filename=?', (os.path.basename(item), ))
+        return rows[0][0] if rows else None
+
+    def pending(self):
+        """Returns a list of items not yet done or failed in the
+        order they were enqueued.
+        """
+        rows = self.execute(
+            f'SELECT item FROM item WHERE status IN ({",".join("?" * len(PENDING))}) '
+            'ORDER BY enqueued', PENDING)
+        return [row[0] for row in rows]
+
+    def timings(self):
+        """Returns a dictionary of status: (count, mean seconds waiting,
+        mean seconds processing, max seconds processing).
+        """
+        rows = self.execute(
+            'SELECT status, COUNT(*), AVG(started - enqueued), '
+            'AVG(finished - started), MAX(finished - started) '
+            'FROM item GROUP BY status')
+        return {row[0]: row[1:] for row in rows}
+
+    def prune(self):
+        """Deletes items done or failed more than `retention` seconds
+        ago and returns the number deleted.
+        """
+        with self.lock:
+            return self.connection.execute(
+                'DELETE FROM item WHERE status IN (?, ?) AND finished < ?',
+                (DONE, FAILED, time.time() - self.retention)).rowcount
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
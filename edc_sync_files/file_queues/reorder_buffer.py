@@ -0,0 +1,95 @@
+import logging
+import threading
+
+from collections import OrderedDict
+from datetime import timedelta
+
+from edc_base.utils import get_utcnow
+
+logger = logging.getLogger('edc_sync_files')
+
+
+class ParkedFile:
+
+    def __init__(self, filename=None, batch_id=None, prev_batch_id=None):
+        self.filename = filename
+        self.batch_id = batch_id
+        self.prev_batch_id = prev_batch_id
+        self.parked_datetime = get_utcnow()
+        self.reported = False
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(filename={self.filename})'
+
+    def __str__(self):
+        return self.filename
+
+
+class ReorderBuffer:
+
+    """Holds incoming files that arrived before their predecessor,
+    keyed by prev_batch_id, until the predecessor is imported.
+
+    Parked files stay in the incoming folder so they are reloaded
+    if the queue restarts.
+    """
+
+    max_age = timedelta(minutes=30)
+
+    def __init__(self, max_age=None):
+        self.max_age = max_age or self.max_age
+        self.parked = {}
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(parked={len(self)})'
+
+    def __len__(self):
+        return sum(len(files) for files in self.parked.values())
+
+    def park(self, filename=None, batch_id=None, prev_batch_id=None):
+        """Parks the file until prev_batch_id is released.
+        """
+        with self.lock:
+            files = self.parked.setdefault(prev_batch_id, OrderedDict())
+            if filename not in files:
+                files[filename] = ParkedFile(
+                    filename=filename,
+                    batch_id=batch_id,
+                    prev_batch_id=prev_batch_id)
+        logger.info(
+            f'{self}: parked {filename}. Waiting for batch {prev_batch_id}.')
+
+    def release(self, batch_id=None):
+        """Removes and returns the filenames of files waiting
+        for batch_id.
+        """
+        with self.lock:
+            files = self.parked.pop(batch_id, {})
+        for filename in files:
+            logger.info(f'{self}: released {filename}.')
+        return list(files)
+
+    def stale(self):
+        """Returns a list of parked files that have waited longer
+        than max_age.
+        """
+        cutoff = get_utcnow() - self.max_age
+        with self.lock:
+            return [parked_file for files in self.parked.values()
+                    for parked_file in files.values()
+                    if parked_file.parked_datetime < cutoff]
+
+    def report_stale(self):
+        """Logs a warning, once, for each parked file that has
+        waited longer than max_age and returns the stale files.
+        """
+        stale = self.stale()
+        for parked_file in stale:
+            if not parked_file.reported:
+                logger.warning(
+                    f'{self}: {parked_file.filename} has been waiting since '
+                    f'{parked_file.parked_datetime} for batch '
+                    f'{parked_file.prev_batch_id}. Is a file missing?')
+                parked_file.reported = True
+        return stale
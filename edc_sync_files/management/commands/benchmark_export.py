@@ -0,0 +1,107 @@
+import shutil
+import tempfile
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ...benchmarks import ExportBenchmark, open_latency
+
+
+class Command(BaseCommand):
+
+    help = ('Benchmark the export pipeline using synthetic outgoing transactions. '
+            'Runs in a transaction that is rolled back, use against sqlite or '
+            'a local database only.')
+
+    def add_arguments(self, parser):
+
+        parser.add_argument(
+            '--using',
+            dest='using',
+            default='default',
+            help=('Database to benchmark against. (Default: default)'),
+        )
+
+        parser.add_argument(
+            '--rows',
+            dest='rows',
+            type=int,
+            default=10000,
+            help=('Number of pending transactions to export. (Default: 10000)'),
+        )
+
+        parser.add_argument(
+            '--payload_sizes',
+            dest='payload_sizes',
+            default='100,1000,10000',
+            help=('Comma separated tx payload sizes in bytes. (Default: 100,1000,10000)'),
+        )
+
+        parser.add_argument(
+            '--compression',
+            dest='compression',
+            default=None,
+            help=('Compress exported files. (Default: None)'),
+        )
+
+        parser.add_argument(
+            '--table_sizes',
+            dest='table_sizes',
+            default=None,
+            help=('Comma separated table sizes. If set, also reports the latency '
+                  'of opening a batch as the table grows. (Default: None)'),
+        )
+
+        parser.add_argument(
+            '--pending',
+            dest='pending',
+            type=int,
+            default=100,
+            help=('Pending transactions per batch when reporting latency. (Default: 100)'),
+        )
+
+    def handle(self, *args, **options):
+        using = options.get('using')
+        export_path = tempfile.mkdtemp()
+        try:
+            with transaction.atomic(using=using):
+                for payload_size in [
+                        int(size) for size in options.get('payload_sizes').split(',')]:
+                    self.report_stages(
+                        ExportBenchmark(
+                            rows=options.get('rows'),
+                            payload_size=payload_size,
+                            using=using,
+                            compression=options.get('compression'),
+                            export_path=export_path))
+                if options.get('table_sizes'):
+                    self.report_open_latency(
+                        table_sizes=[
+                            int(size) for size in options.get('table_sizes').split(',')],
+                        pending=options.get('pending'),
+                        using=using)
+                transaction.set_rollback(True, using=using)
+        finally:
+            shutil.rmtree(export_path, ignore_errors=True)
+
+    def report_stages(self, benchmark=None):
+        self.stdout.write(
+            f'\n{benchmark.rows} rows, payload {benchmark.payload_size} bytes\n')
+        self.stdout.write(
+            f'{"stage":<10} {"seconds":>10} {"rows/s":>12} {"MB/s":>10} '
+            f'{"peak RSS (MB)":>14}\n')
+        for result in benchmark.run():
+            mb_per_second = (
+                '' if result.mb_per_second is None else f'{result.mb_per_second:.2f}')
+            self.stdout.write(
+                f'{result.stage:<10} {result.seconds:>10.3f} '
+                f'{result.rows_per_second:>12.0f} {mb_per_second:>10} '
+                f'{result.peak_rss:>14.1f}\n')
+
+    def report_open_latency(self, table_sizes=None, pending=None, using=None):
+        self.stdout.write(
+            f'\n{"rows":>10} {"full scan (ms)":>16} {"watermark (ms)":>16}\n')
+        for size, full_scan, watermark in open_latency(
+                table_sizes=table_sizes, pending=pending, using=using):
+            self.stdout.write(
+                f'{size:>10} {full_scan * 1000:>16.1f} {watermark * 1000:>16.1f}\n')
@@ -1,10 +1,11 @@
 import logging
+import os
 
 from django.apps import apps as django_apps
 from django.core.management.base import BaseCommand
 from edc_device.constants import NODE_SERVER, CENTRAL_SERVER
 
-from ...file_queues import process_queue
+from ...file_queues import process_queue, process_queue_concurrently
 from ...observers import DeserializeTransactionsFileQueueObserver
 
 
@@ -40,7 +41,42 @@ class Command(BaseCommand):
             help=(f'Archive path on localhost. (Default: {app_config.archive_folder}. See app_config.)'),
         )
 
+        parser.add_argument(
+            '--group_size',
+            dest='group_size',
+            type=int,
+            default=1,
+            help=('Deserialize up to this many queued files from the same producer '
+                  'in one database transaction. (Default: 1)'),
+        )
+
+        parser.add_argument(
+            '--journal',
+            dest='journal',
+            action='store_true',
+            default=False,
+            help=(f'Keep a durable journal of the queue in {app_config.log_folder} '
+                  f'and resume pending files from it on restart.'),
+        )
+
+        parser.add_argument(
+            '--workers',
+            dest='workers',
+            type=int,
+            default=1,
+            help=('Number of worker threads. Files from different producers are '
+                  'processed concurrently, each producer\'s files in order. '
+                  '(Default: 1)'),
+        )
+
     def handle(self, *args, **options):
+        if options.get('journal'):
+            options.update(journal_path=os.path.join(
+                app_config.log_folder, 'deserialize_queue.sqlite3'))
+        if options.get('workers') > 1:
+            task_processor = process_queue_concurrently
+        else:
+            task_processor = process_queue
         file_observer = self.file_observer_cls(
-            task_processor=process_queue, **options)
+            task_processor=task_processor, **options)
         file_observer.start()
@@ -3,6 +3,7 @@ import logging
 from django.apps import apps as django_apps
 from django.core.management.base import BaseCommand, CommandError
 
+from ...constants import GZIP, XZ
 from ...models import ExportedTransactionFileHistory
 from ...transaction import TransactionExporter, TransactionFileSender, TransactionFileSenderError
 
@@ -56,6 +57,55 @@ class Command(BaseCommand):
             help=(f'Archive path on localhost. (Default: {app_config.archive_folder}. See app_config.)'),
         )
 
+        parser.add_argument(
+            '--max_count',
+            dest='max_count',
+            type=int,
+            default=None,
+            help=('Maximum number of transactions per exported file. (Default: None)'),
+        )
+
+        parser.add_argument(
+            '--max_bytes',
+            dest='max_bytes',
+            type=int,
+            default=None,
+            help=('Approximate maximum bytes of transactions per exported file. (Default: None)'),
+        )
+
+        parser.add_argument(
+            '--compression',
+            dest='compression',
+            choices=[GZIP, XZ],
+            default=None,
+            help=(f'Compress exported files using {GZIP} or {XZ}. (Default: None)'),
+        )
+
+        parser.add_argument(
+            '--full_scan',
+            dest='full_scan',
+            action='store_true',
+            default=False,
+            help=('Select pending transactions from the whole table instead '
+                  'of from the export watermark. (Default: False)'),
+        )
+
+        parser.add_argument(
+            '--coalesce',
+            dest='coalesce',
+            action='store_true',
+            default=False,
+            help=('Export only the last transaction per record in each batch. (Default: False)'),
+        )
+
+        parser.add_argument(
+            '--channels',
+            dest='channels',
+            type=int,
+            default=None,
+            help=('Number of SFTP channels to upload files on in parallel. (Default: 1)'),
+        )
+
         parser.add_argument(
             '--export_only',
             dest='export_only',
@@ -74,7 +124,7 @@ class Command(BaseCommand):
 
         if not options.get('send_only'):
             tx_exporter = self.tx_exporter_cls(**options)
-            tx_exporter.export_batch()
+            tx_exporter.export_batches()
 
         if not options.get('export_only'):
             tx_file_sender = self.tx_file_sender_cls(
@@ -85,9 +135,11 @@ class Command(BaseCommand):
                 src_path=options.get('export_path'),
                 dst_tmp=options.get('tmp_path'),
                 dst_path=options.get('target_path'),
-                archive_path=options.get('archive_path'))
+                archive_path=options.get('archive_path'),
+                channels=options.get('channels'))
             filenames = [
-                obj.filename for obj in self.history_model.objects.filter(sent=False)]
+                obj.filename for obj in self.history_model.objects.filter(
+                    sent=False).order_by('created')]
             try:
                 tx_file_sender.send(filenames=filenames)
             except TransactionFileSenderError as e:
@@ -1,10 +1,13 @@
 import logging
+import os
 
 from django.apps import apps as django_apps
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from edc_device.constants import NODE_SERVER, CENTRAL_SERVER
 
-from ...file_queues import process_queue
+from ...file_queues import process_queue, process_queue_concurrently
 from ...observers import IncomingTransactionsFileQueueObserver
+from ...observers import ImportDeserializeTransactionsFileQueueObserver
 
 
 app_config = django_apps.get_app_config('edc_sync_files')
@@ -16,6 +19,7 @@ class Command(BaseCommand):
     help = 'Start observer that imports files into the incoming transactions model.'
 
     file_observer_cls = IncomingTransactionsFileQueueObserver
+    fused_file_observer_cls = ImportDeserializeTransactionsFileQueueObserver
 
     def add_arguments(self, parser):
 
@@ -33,7 +37,78 @@ class Command(BaseCommand):
             help=(f'Pending path on localhost. (Default: {app_config.archive_folder}. See app_config.)'),
         )
 
+        parser.add_argument(
+            '--fused',
+            dest='fused',
+            action='store_true',
+            default=False,
+            help=('Import and deserialize each file in one stage then archive it. '
+                  f'Files are archived to {app_config.archive_folder} unless '
+                  '--dst_path is set. Do not also run the deserialize_observer.'),
+        )
+
+        parser.add_argument(
+            '--override_role',
+            dest='override_role',
+            default=None,
+            help=(f'With --fused, specify the device role to deserialize transactions '
+                  f'({NODE_SERVER}, {CENTRAL_SERVER}). Not recommended. '),
+        )
+
+        parser.add_argument(
+            '--chunked',
+            dest='chunked',
+            action='store_true',
+            default=False,
+            help=('Save transactions in chunks as they are read from the file '
+                  'to bound memory. Each file is still saved all or nothing.'),
+        )
+
+        parser.add_argument(
+            '--checkpoints',
+            dest='checkpoints',
+            action='store_true',
+            default=False,
+            help=('Commit transactions in chunks with a checkpoint so an interrupted '
+                  'import resumes where it stopped.'),
+        )
+
+        parser.add_argument(
+            '--journal',
+            dest='journal',
+            action='store_true',
+            default=False,
+            help=(f'Keep a durable journal of the queue in {app_config.log_folder} '
+                  f'and resume pending files from it on restart.'),
+        )
+
+        parser.add_argument(
+            '--workers',
+            dest='workers',
+            type=int,
+            default=1,
+            help=('Number of worker threads. Files from different producers are '
+                  'processed concurrently, each producer\'s files in order. '
+                  '(Default: 1)'),
+        )
+
     def handle(self, *args, **options):
-        file_observer = self.file_observer_cls(
-            task_processor=process_queue, **options)
+        if options.get('journal'):
+            options.update(journal_path=os.path.join(
+                app_config.log_folder, 'incoming_queue.sqlite3'))
+        if options.get('workers') > 1:
+            task_processor = process_queue_concurrently
+        else:
+            task_processor = process_queue
+        if options.get('fused'):
+            if options.get('chunked') or options.get('checkpoints'):
+                raise CommandError(
+                    '--fused cannot be used with --chunked or --checkpoints.')
+            if options.get('dst_path') == app_config.pending_folder:
+                options.update(dst_path=app_config.archive_folder)
+            file_observer_cls = self.fused_file_observer_cls
+        else:
+            file_observer_cls = self.file_observer_cls
+        file_observer = file_observer_cls(
+            task_processor=task_processor, **options)
         file_observer.start()
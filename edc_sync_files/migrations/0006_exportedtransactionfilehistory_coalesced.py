@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('edc_sync_files', '0005_exportedtransactionwatermark'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportedtransactionfilehistory',
+            name='coalesced',
+            field=models.IntegerField(default=0, help_text='Number of superseded transactions left out of the file.'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def remove_duplicate_batch_ids(apps, schema_editor):
+    """Keeps one history per batch_id, the consumed or else the
+    earliest, before batch_id is made unique.
+    """
+    model = apps.get_model('edc_sync_files', 'importedtransactionfilehistory')
+    db_alias = schema_editor.connection.alias
+    duplicates = model.objects.using(db_alias).values('batch_id').annotate(
+        count=Count('pk')).filter(batch_id__isnull=False, count__gt=1)
+    for duplicate in duplicates:
+        histories = model.objects.using(db_alias).filter(
+            batch_id=duplicate['batch_id']).order_by('-consumed', 'created')
+        kept = histories.first()
+        histories.exclude(pk=kept.pk).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('edc_sync_files', '0007_exportedtransactionchainhead'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            remove_duplicate_batch_ids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='importedtransactionfilehistory',
+            name='batch_id',
+            field=models.CharField(max_length=100, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='importedtransactionfilehistory',
+            name='prev_batch_id',
+            field=models.CharField(db_index=True, max_length=100, null=True),
+        ),
+    ]
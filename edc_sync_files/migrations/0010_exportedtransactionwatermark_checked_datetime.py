@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('edc_sync_files', '0009_importedtransactionfilecheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportedtransactionwatermark',
+            name='checked_datetime',
+            field=models.DateTimeField(help_text='When pending transactions behind the watermark were last checked for.', null=True),
+        ),
+    ]
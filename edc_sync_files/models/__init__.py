@@ -1,2 +1,5 @@
+from .exported_transaction_chain_head import ExportedTransactionChainHead
 from .exported_transaction_file_history import ExportedTransactionFileHistory
+from .exported_transaction_watermark import ExportedTransactionWatermark
+from .imported_transaction_file_checkpoint import ImportedTransactionFileCheckpoint
 from .imported_transaction_file_history import ImportedTransactionFileHistory
@@ -0,0 +1,33 @@
+from django.db import models
+
+from edc_base.model_mixins import BaseUuidModel
+
+
+class ExportedTransactionChainHead(BaseUuidModel):
+    """A model that keeps the batch_id of the last batch
+    exported per device, site and database.
+
+    The next batch takes this batch_id as its prev_batch_id.
+    """
+
+    device_id = models.CharField(
+        max_length=5)
+
+    site_code = models.CharField(
+        max_length=100)
+
+    using = models.CharField(
+        max_length=25)
+
+    batch_id = models.CharField(
+        max_length=100,
+        null=True)
+
+    objects = models.Manager()
+
+    def __str__(self):
+        return f'{self.device_id} {self.site_code} {self.using}: {self.batch_id}'
+
+    class Meta:
+        verbose_name = 'Export Chain Head'
+        unique_together = (('device_id', 'site_code', 'using'),)
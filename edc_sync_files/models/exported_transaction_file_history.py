@@ -56,6 +56,10 @@ class ExportedTransactionFileHistory(BaseUuidModel):
 
     exported_datetime = models.DateTimeField(null=True)
 
+    coalesced = models.IntegerField(
+        default=0,
+        help_text='Number of superseded transactions left out of the file.')
+
     sent = models.BooleanField(
         default=False,
         blank=True)
@@ -0,0 +1,34 @@
+from django.db import models
+
+from edc_base.model_mixins import BaseUuidModel
+
+
+class ExportedTransactionWatermark(BaseUuidModel):
+    """A model that keeps the high-water mark of outgoing
+    transactions exported from a database on this host.
+
+    Pending transactions are selected after the watermark
+    instead of scanning the whole table.
+    """
+
+    using = models.CharField(
+        max_length=25,
+        unique=True)
+
+    last_created = models.DateTimeField(
+        null=True)
+
+    last_pk = models.UUIDField(
+        null=True)
+
+    checked_datetime = models.DateTimeField(
+        null=True,
+        help_text='When pending transactions behind the watermark were last checked for.')
+
+    objects = models.Manager()
+
+    def __str__(self):
+        return f'{self.using}: {self.last_created}'
+
+    class Meta:
+        verbose_name = 'Export Watermark'
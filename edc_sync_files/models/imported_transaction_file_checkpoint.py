@@ -0,0 +1,35 @@
+from django.db import models
+
+from edc_base.model_mixins import BaseUuidModel
+
+
+class ImportedTransactionFileCheckpoint(BaseUuidModel):
+    """A model that tracks how far the import of a transaction
+    file has been committed.
+
+    Deleted once the file's import history is created.
+    """
+
+    filename = models.CharField(
+        max_length=50,
+        unique=True)
+
+    batch_id = models.CharField(
+        max_length=100,
+        null=True)
+
+    offset = models.IntegerField(
+        default=0,
+        help_text='Number of objects in the file committed.')
+
+    last_pk = models.UUIDField(
+        null=True,
+        help_text='Primary key of the last object committed.')
+
+    objects = models.Manager()
+
+    def __str__(self):
+        return f'{self.filename}: {self.offset}'
+
+    class Meta:
+        verbose_name = 'Import Checkpoint'
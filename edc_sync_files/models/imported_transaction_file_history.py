@@ -18,11 +18,13 @@ class ImportedTransactionFileHistory(BaseUuidModel):
 
     batch_id = models.CharField(
         max_length=100,
-        null=True)
+        null=True,
+        unique=True)
 
     prev_batch_id = models.CharField(
         max_length=100,
-        null=True)
+        null=True,
+        db_index=True)
 
     filedate = models.DateField(
         null=True,
@@ -1 +1,2 @@
 from .observers import IncomingTransactionsFileQueueObserver, DeserializeTransactionsFileQueueObserver
+from .observers import ImportDeserializeTransactionsFileQueueObserver
@@ -23,7 +23,7 @@ class FileQueueObserver:
 
     def start(self):
         queue = self.queue_cls(**self.options)
-        queue.reload(**self.options)
+        queue.startup()
 
         handler = self.handler_cls(queue=queue, **self.options)
         # watchdog observer
@@ -34,6 +34,12 @@ class FileQueueObserver:
         sys.stdout.write(f'{watch.__class__.__name__} {watch.path}\n')
         observer.start()
 
+        # start watching before reloading in the background so no
+        # file is missed and processing starts right away. Files
+        # found by the observer are held by the queue until the
+        # reload has put the older files.
+        queue.reload(background=True, **self.options)
+
         dt = datetime.now().strftime('%Y-%m-%d %H:%M')
         sys.stdout.write(f'\nStarted {dt}\n')
         sys.stdout.write('\nReady. Press CTRL-C to stop.\n\n')
@@ -49,6 +55,7 @@ class FileQueueObserver:
             observer.stop()
         observer.join()
         queue.join()
+        queue.shutdown()
         logger.info(f'{observer} stopped')
         dt = datetime.now().strftime('%Y-%m-%d %H:%M')
         sys.stdout.write(f'\n{observer} stopped {dt}\n')
@@ -1,8 +1,10 @@
 from django.apps import apps as django_apps
 
 from ..file_queues import DeserializeTransactionsFileQueue
+from ..file_queues import ImportDeserializeTransactionsFileQueue
 from ..file_queues import IncomingTransactionsFileQueue
 from ..models import ImportedTransactionFileHistory
+from ..patterns import transaction_file_regexes
 from .file_queue_observer import FileQueueObserver
 from ..file_queues.file_queue_handlers import (
     RegexFileQueueHandlerIncoming, RegexFileQueueHandlerPending)
@@ -14,16 +16,28 @@ class IncomingTransactionsFileQueueObserver(FileQueueObserver):
     handler_cls = RegexFileQueueHandlerIncoming
     queue_cls = IncomingTransactionsFileQueue
     options = dict(
-        regexes=[r'(\/\w+)+\.json$', r'\w+\.json$'],
+        regexes=transaction_file_regexes,
         src_path=app_config.incoming_folder,
-        dst_path=app_config.pending_folder)
+        dst_path=app_config.pending_folder,
+        quarantine_path=app_config.quarantine_folder)
 
 
 class DeserializeTransactionsFileQueueObserver(FileQueueObserver):
     handler_cls = RegexFileQueueHandlerPending
     queue_cls = DeserializeTransactionsFileQueue
     options = dict(
-        regexes=[r'(\/\w+)+\.json$', r'\w+\.json$'],
+        regexes=transaction_file_regexes,
         src_path=app_config.pending_folder,
         dst_path=app_config.archive_folder,
+        quarantine_path=app_config.quarantine_folder,
         history_model=ImportedTransactionFileHistory)
+
+
+class ImportDeserializeTransactionsFileQueueObserver(FileQueueObserver):
+    handler_cls = RegexFileQueueHandlerIncoming
+    queue_cls = ImportDeserializeTransactionsFileQueue
+    options = dict(
+        regexes=transaction_file_regexes,
+        src_path=app_config.incoming_folder,
+        dst_path=app_config.archive_folder,
+        quarantine_path=app_config.quarantine_folder)
@@ -1 +1,7 @@
-transaction_filename_regexes = [r'^\w+\_\d{14}\.json$']
+transaction_filename_regexes = [r'^\w+\_\d{14}\.json(\.gz|\.xz)?$']
+transaction_file_regexes = [r'(\/\w+)+\.json(\.gz|\.xz)?$', r'\w+\.json(\.gz|\.xz)?$']
+# producer prefix and timestamp of a transaction filename, e.g.
+# device_id + site_code before a 20 digit timestamp or hostname
+# before a 14 digit timestamp
+transaction_filename_producer_regex = (
+    r'^(?P<producer>\w+?)_?(?P<timestamp>\d{14}(\d{6})?)\.json(\.gz|\.xz)?$')
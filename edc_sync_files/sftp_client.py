@@ -1,9 +1,13 @@
+import hashlib
 import logging
 import os
 import sys
 
+from paramiko.ssh_exception import SSHException
 from paramiko.util import ClosingContextManager
 
+from .constants import MANIFEST_SUFFIX
+
 logger = logging.getLogger('edc_sync_files')
 
 
@@ -15,9 +19,22 @@ class SFTPClient(ClosingContextManager):
 
     """Wraps open_sftp with folder defaults for copy.
 
-    Copy is two steps; put then rename.
+    Copy is two steps; upload (put to dst_tmp) then commit
+    (rename into dst_path).
+
+    If resume is True, put appends to a partial upload left in
+    dst_tmp by an earlier, dropped, connection instead of sending
+    the whole file again, provided the partial upload matches the
+    start of the source file.
+
+    If scanned, the sizes of the files in dst_path and dst_tmp are
+    listed once and used instead of a stat for each file.
     """
 
+    block_size = 32768
+    resume = True
+    window = 1024 * 1024
+
     def __init__(self, src_path=None, dst_path=None, dst_tmp=None, verbose=None, **kwargs):
         self.src_path = src_path
         self.dst_tmp = dst_tmp
@@ -25,43 +42,226 @@ class SFTPClient(ClosingContextManager):
         self._sftp_client = None
         self.verbose = verbose
         self.progress = 0
+        self.remote_sizes = None
 
     def connect(self, ssh_conn=None):
         self._sftp_client = ssh_conn.open_sftp()
+        self.remote_sizes = None
         return self
 
+    def open_channel(self, ssh_conn=None):
+        """Returns a new SFTPClient, with the same folders, on its
+        own SFTP channel of ssh_conn's transport.
+        """
+        sftp_client = self.__class__(
+            src_path=self.src_path, dst_path=self.dst_path,
+            dst_tmp=self.dst_tmp, verbose=self.verbose)
+        try:
+            sftp_client._sftp_client = ssh_conn.open_sftp(reuse=False)
+        except (SSHException, OSError) as e:
+            raise SFTPClientError(f'Failed to open an SFTP channel. Got {e}') from e
+        sftp_client.remote_sizes = self.remote_sizes
+        return sftp_client
+
+    def scan(self):
+        """Lists dst_path and dst_tmp and records the size of each
+        remote file.
+
+        A folder that cannot be listed is treated as empty.
+        """
+        self.remote_sizes = {}
+        for path in [self.dst_path, self.dst_tmp]:
+            if not path:
+                continue
+            try:
+                attrs = self._sftp_client.listdir_attr(path)
+            except (SSHException, EOFError) as e:
+                raise SFTPClientError(
+                    f'Connection lost. Failed to list {path}.') from e
+            except IOError as e:
+                logger.warning(f'Unable to list remote folder {path}. Got {e}')
+                continue
+            for attr in attrs:
+                self.remote_sizes[os.path.join(path, attr.filename)] = attr.st_size
+
+    def get_remote_size(self, path=None):
+        """Returns the size of the remote file or None if it
+        does not exist.
+        """
+        if self.remote_sizes is not None:
+            return self.remote_sizes.get(path)
+        try:
+            return self._sftp_client.stat(path).st_size
+        except IOError:
+            return None
+
+    def remote_sha256(self, path=None):
+        """Returns the sha256 hexdigest of the remote file or None
+        if the server does not support the check-file extension.
+        """
+        with self._sftp_client.open(path, 'rb') as remote:
+            try:
+                return remote.check('sha256', 0, 0, 0).hex()
+            except IOError:
+                return None
+
+    def delivered(self, filename=None, sha256=None):
+        """Returns True if the file, and its manifest if any, are
+        already in dst_path with the same size as the local files.
+
+        If sha256 is given and the server supports the check-file
+        extension, the checksum of the remote file must match too.
+        """
+        try:
+            return self.matches_remote(filename=filename, sha256=sha256)
+        except (SSHException, EOFError) as e:
+            raise SFTPClientError(
+                f'Connection lost. Failed to check {filename}.') from e
+
+    def matches_remote(self, filename=None, sha256=None):
+        for name in self.get_filenames(filename):
+            size = self.get_remote_size(os.path.join(self.dst_path, name))
+            if size != os.path.getsize(os.path.join(self.src_path, name)):
+                return False
+        if sha256:
+            try:
+                remote_sha256 = self.remote_sha256(os.path.join(self.dst_path, filename))
+            except IOError:
+                return False
+            return remote_sha256 is None or remote_sha256 == sha256
+        return True
+
     def close(self):
         self._sftp_client.close()
 
     def copy(self, filename=None):
         """Puts on destination as a temp file, renames on the destination.
+
+        If the file has a manifest, the manifest is copied first so
+        it is in place before the file appears on the destination.
+        """
+        self.upload(filename=filename)
+        self.commit(filename=filename)
+
+    def upload(self, filename=None):
+        """Puts the file, and its manifest if any, in dst_tmp.
+        """
+        for name in self.get_filenames(filename):
+            self.put(src=os.path.join(self.src_path, name),
+                     dst=os.path.join(self.dst_tmp, name),
+                     callback=self.update_progress, confirm=True)
+
+    def commit(self, filename=None):
+        """Renames the uploaded file, and its manifest if any, from
+        dst_tmp into dst_path.
+        """
+        for name in self.get_filenames(filename):
+            self.rename(src=os.path.join(self.dst_tmp, name),
+                        dst=os.path.join(self.dst_path, name))
+
+    def get_filenames(self, filename=None):
+        """Returns a list of the manifest, if any, and the file.
         """
-        dst = os.path.join(self.dst_path, filename)
-        src = os.path.join(self.src_path, filename)
-        dst_tmp = os.path.join(self.dst_tmp, f'{filename}')
-        self.put(src=src, dst=dst_tmp,
-                 callback=self.update_progress, confirm=True)
-        self.rename(src=dst_tmp, dst=dst)
+        manifest = f'{filename}{MANIFEST_SUFFIX}'
+        if os.path.exists(os.path.join(self.src_path, manifest)):
+            return [manifest, filename]
+        return [filename]
 
     def put(self, src=None, dst=None, callback=None, confirm=None):
         if not os.path.exists(src):
             raise SFTPClientError(f'Source file does not exist. Got \'{src}\'')
         self.progress = 0
         try:
-            self._sftp_client.put(src, dst, callback=callback, confirm=confirm)
+            offset = self.get_resume_offset(src=src, dst=dst) if self.resume else 0
+            if offset:
+                self.append(src=src, dst=dst, offset=offset,
+                            callback=callback, confirm=confirm)
+            else:
+                self._sftp_client.put(src, dst, callback=callback, confirm=confirm)
+        except (SSHException, EOFError) as e:
+            raise SFTPClientError(
+                f'Connection lost. Failed to copy {src}.') from e
         except IOError as e:
             raise SFTPClientError(
                 f'IOError. Failed to copy {src}.') from e
+        if self.remote_sizes is not None:
+            self.remote_sizes[dst] = os.path.getsize(src)
         if self.verbose:
             logger.info(f'Copied {src} to {dst}')
             sys.stdout.write('\n')
 
+    def get_resume_offset(self, src=None, dst=None):
+        """Returns the size of a partial upload of src at dst if
+        it matches the start of src, otherwise 0.
+        """
+        size = self.get_remote_size(dst)
+        if not size or size > os.path.getsize(src):
+            return 0
+        if not self.prefix_matches(src=src, dst=dst, size=size):
+            logger.info(f'Partial upload {dst} does not match {src}. Sending it again.')
+            return 0
+        return size
+
+    def prefix_matches(self, src=None, dst=None, size=None):
+        """Returns True if the sha256 of the first size bytes of src
+        and of dst are the same.
+
+        Uses the server's check-file extension if supported, otherwise
+        reads and compares the last `window` bytes of the prefix.
+        """
+        with self._sftp_client.open(dst, 'rb') as remote:
+            try:
+                remote_digest = remote.check('sha256', 0, size, 0)
+                start = 0
+            except IOError:
+                start = max(0, size - self.window)
+                remote.seek(start)
+                remote_digest = hashlib.sha256(remote.read(size - start)).digest()
+        local = hashlib.sha256()
+        with open(src, 'rb') as f:
+            f.seek(start)
+            remaining = size - start
+            while remaining:
+                data = f.read(min(self.block_size, remaining))
+                if not data:
+                    break
+                local.update(data)
+                remaining -= len(data)
+        return local.digest() == remote_digest
+
+    def append(self, src=None, dst=None, offset=None, callback=None, confirm=None):
+        """Appends src, from offset, to dst.
+        """
+        size = os.path.getsize(src)
+        sent = offset
+        with open(src, 'rb') as f, self._sftp_client.open(dst, 'ab') as remote:
+            remote.set_pipelined(True)
+            f.seek(offset)
+            while True:
+                data = f.read(self.block_size)
+                if not data:
+                    break
+                remote.write(data)
+                sent += len(data)
+                if callback:
+                    callback(sent, size)
+        if confirm:
+            remote_size = self._sftp_client.stat(dst).st_size
+            if remote_size != size:
+                raise IOError(f'size mismatch in put! {remote_size} != {size}')
+        logger.info(f'Resumed {dst} at {offset} of {size} bytes.')
+
     def rename(self, src=None, dst=None):
         try:
             self._sftp_client.rename(src, dst)
+        except (SSHException, EOFError) as e:
+            raise SFTPClientError(
+                f'Connection lost. Failed to rename {src} to {dst}.') from e
         except IOError as e:
             raise SFTPClientError(
                 f'IOError. Failed to rename {src} to {dst}.') from e
+        if self.remote_sizes is not None:
+            self.remote_sizes[dst] = self.remote_sizes.pop(src, None)
 
     def update_progress(self, sent_bytes, total_bytes):
         self.progress = (sent_bytes / total_bytes) * 100
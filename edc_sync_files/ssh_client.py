@@ -1,4 +1,5 @@
 import socket
+import threading
 
 import paramiko
 from paramiko import AutoAddPolicy
@@ -14,14 +15,16 @@ class SSHClientError(Exception):
 class SSHClient(ClosingContextManager):
 
     def __init__(self, remote_host=None, trusted_host=None, username=None, timeout=None,
-                 banner_timeout=None, compress=None, **kwargs):
+                 banner_timeout=None, compress=None, keepalive=None, **kwargs):
         self.banner_timeout = banner_timeout or 5
         self.compress = True if compress is None else compress
+        self.keepalive = keepalive or 30
         self.remote_host = remote_host
         self.timeout = timeout or 5
         self.trusted_host = True if trusted_host is None else trusted_host
         self.username = username
         self._ssh_client = paramiko.SSHClient()
+        self._sftp = None
 
     def connect(self):
         if self.trusted_host:
@@ -38,9 +41,12 @@ class SSHClient(ClosingContextManager):
                 SSHException, OSError) as e:
             raise SSHClientError(
                 f'{self.username}@{self.remote_host}: \'{e}\'.') from e
+        self._ssh_client.get_transport().set_keepalive(self.keepalive)
+        self._sftp = None
         return self
 
     def close(self):
+        self._sftp = None
         self._ssh_client.close()
 
     @property
@@ -51,5 +57,69 @@ class SSHClient(ClosingContextManager):
         except AttributeError:
             return False
 
-    def open_sftp(self):
-        return self._ssh_client.open_sftp()
+    def open_sftp(self, reuse=None):
+        """Returns an SFTP channel, reusing the last one opened
+        if it is still open unless reuse is False.
+        """
+        if reuse is False:
+            return self._ssh_client.open_sftp()
+        if self._sftp is None or self._sftp.get_channel().closed:
+            self._sftp = self._ssh_client.open_sftp()
+        return self._sftp
+
+
+class SSHConnectionPool:
+
+    """A process-wide pool of connected SSH clients, one per
+    username and remote host.
+
+    A pooled client is reused while its transport is active and
+    is replaced by a new connection once the transport is dead.
+    """
+
+    def __init__(self):
+        self.connections = {}
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(connections={len(self.connections)})'
+
+    @staticmethod
+    def get_key(ssh_client=None):
+        return (getattr(ssh_client, 'username', None),
+                getattr(ssh_client, 'remote_host', None))
+
+    def connect(self, ssh_client=None):
+        """Returns the pooled client for ssh_client's username and
+        remote host, connecting ssh_client if there is none or the
+        pooled client is no longer connected.
+        """
+        key = self.get_key(ssh_client)
+        with self.lock:
+            pooled = self.connections.get(key)
+            if pooled is not None and pooled.connected:
+                return pooled
+            if pooled is not None:
+                pooled.close()
+            ssh_conn = ssh_client.connect()
+            self.connections[key] = ssh_conn
+            return ssh_conn
+
+    def discard(self, ssh_client=None):
+        """Closes and removes the pooled client for ssh_client's
+        username and remote host.
+        """
+        with self.lock:
+            pooled = self.connections.pop(self.get_key(ssh_client), None)
+        if pooled is not None:
+            pooled.close()
+
+    def close(self):
+        with self.lock:
+            connections = list(self.connections.values())
+            self.connections.clear()
+        for ssh_conn in connections:
+            ssh_conn.close()
+
+
+ssh_connection_pool = SSHConnectionPool()
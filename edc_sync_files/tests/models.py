@@ -26,3 +26,23 @@ class TestModel(BaseUuidModel):
 
     def natural_key(self):
         return (self.f1, )
+
+
+class TestModelChildManager(models.Manager):
+
+    def get_by_natural_key(self, f1):
+        return self.get(f1=f1)
+
+
+class TestModelChild(BaseUuidModel):
+
+    test_model = models.ForeignKey(TestModel, on_delete=models.PROTECT)
+
+    f1 = models.CharField(max_length=10, unique=True)
+
+    objects = TestModelChildManager()
+
+    history = HistoricalRecords()
+
+    def natural_key(self):
+        return (self.f1, )
@@ -1,6 +1,9 @@
+import io
 import os
 import shutil
 
+from types import SimpleNamespace
+
 from django.apps import apps as django_apps
 
 from edc_sync_files.ssh_client import SSHClientError
@@ -34,7 +37,9 @@ class MockSSHClient:
     def connected(self):
         return self._connected
 
-    def open_sftp(self):
+    def open_sftp(self, reuse=None):
+        if reuse is False:
+            return MockSFTPClient()
         return self._sftp_client
 
     def put(self, src, dst, callback=None, confirm=True):
@@ -99,6 +104,26 @@ class MockSFTPClient:
         # Mock rename operation: Do nothing or simulate behavior.
         shutil.copy2(src, dst)
 
+    def stat(self, path):
+        return os.stat(path)
+
+    def listdir_attr(self, path='.'):
+        return [SimpleNamespace(filename=entry.name, st_size=entry.stat().st_size)
+                for entry in os.scandir(path)]
+
+    def open(self, path, mode='r'):
+        return MockSFTPFile(path, mode)
+
+
+class MockSFTPFile(io.FileIO):
+
+    def check(self, hash_algorithm, offset=0, length=0, block_size=0):
+        # like sftp servers without the check-file extension
+        raise IOError('Unsupported')
+
+    def set_pipelined(self, pipelined=True):
+        pass
+
 
 class MockSSHClientWithError:
 
@@ -121,7 +146,9 @@ class MockSSHClientWithError:
     def connected(self):
         return self._connected
 
-    def open_sftp(self):
+    def open_sftp(self, reuse=None):
+        if reuse is False:
+            return MockSFTPClient()
         return self._sftp_client
 
     def put(self, src, dst, callback=None, confirm=True):
@@ -0,0 +1,40 @@
+import tempfile
+
+from django.test.testcases import TestCase
+from django.test.utils import tag
+
+from edc_sync.models import OutgoingTransaction
+
+from ..benchmarks import ExportBenchmark, make_outgoing_transactions
+from ..models import ExportedTransactionFileHistory
+
+
+@tag('benchmark')
+class TestExportBenchmark(TestCase):
+
+    databases = '__all__'
+
+    def setUp(self):
+        ExportedTransactionFileHistory.objects.using('client').all().delete()
+        OutgoingTransaction.objects.using('client').all().delete()
+
+    def test_make_outgoing_transactions(self):
+        make_outgoing_transactions(count=5, payload_size=10, using='client')
+        self.assertEqual(OutgoingTransaction.objects.using('client').filter(
+            is_consumed_server=False).count(), 5)
+
+    def test_export_benchmark(self):
+        """Assert times each stage of the export.
+        """
+        benchmark = ExportBenchmark(
+            rows=10, payload_size=100, using='client',
+            export_path=tempfile.gettempdir())
+        results = benchmark.run()
+        self.assertEqual(
+            [result.stage for result in results],
+            ['open', 'serialize', 'write', 'close'])
+        for result in results:
+            self.assertEqual(result.rows, 10)
+            self.assertGreater(result.peak_rss, 0)
+        self.assertEqual(OutgoingTransaction.objects.using('client').filter(
+            is_consumed_server=False).count(), 0)
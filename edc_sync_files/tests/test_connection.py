@@ -208,3 +208,37 @@ class TestConnector(TestCase):
                            sftp_client.update_progress, True),
                           ssh_conn.open_sftp().put_args)
             self.assertIsNotNone(cm.output)
+
+    def test_sftp_put_resumes_partial_upload(self):
+        with patch('edc_sync_files.tests.test_connection.SSHClient', new=MockSSHClient):
+            ssh_client = SSHClient(remote_host='localhost', trusted_host=True, timeout=1)
+            _, src = tempfile.mkstemp()
+            with open(src, 'wb') as fd:
+                fd.write(os.urandom(100000))
+            dst = tempfile.mktemp()
+            with open(src, 'rb') as fd, open(dst, 'wb') as partial:
+                partial.write(fd.read(90000))
+            with ssh_client.connect() as ssh_conn:
+                sftp_client = SFTPClient()
+                with sftp_client.connect(ssh_conn=ssh_conn) as sftp_conn:
+                    sftp_conn.put(src, dst, confirm=True)
+            self.assertEqual(ssh_conn.open_sftp().put_args, [])
+            with open(src, 'rb') as fd1, open(dst, 'rb') as fd2:
+                self.assertEqual(fd1.read(), fd2.read())
+
+    def test_sftp_put_sends_again_if_partial_upload_differs(self):
+        with patch('edc_sync_files.tests.test_connection.SSHClient', new=MockSSHClient):
+            ssh_client = SSHClient(remote_host='localhost', trusted_host=True, timeout=1)
+            _, src = tempfile.mkstemp()
+            with open(src, 'wb') as fd:
+                fd.write(os.urandom(100000))
+            dst = tempfile.mktemp()
+            with open(dst, 'wb') as partial:
+                partial.write(os.urandom(90000))
+            with ssh_client.connect() as ssh_conn:
+                sftp_client = SFTPClient()
+                with sftp_client.connect(ssh_conn=ssh_conn) as sftp_conn:
+                    sftp_conn.put(src, dst, confirm=True)
+            self.assertEqual(len(ssh_conn.open_sftp().put_args), 1)
+            with open(src, 'rb') as fd1, open(dst, 'rb') as fd2:
+                self.assertEqual(fd1.read(), fd2.read())
@@ -11,6 +11,7 @@ from edc_sync.models import OutgoingTransaction
 
 from .servers import MockSSHClient
 from ..file_queues import IncomingTransactionsFileQueue, DeserializeTransactionsFileQueue, process_queue
+from ..file_queues import ImportDeserializeTransactionsFileQueue
 from ..models import ImportedTransactionFileHistory, ExportedTransactionFileHistory
 from ..transaction import TransactionExporter, TransactionFileSender
 from .models import TestModel
@@ -303,3 +304,36 @@ class TestFileEventHandler(TestCase):
             deserialize_queue.join()
 
             self.assertEqual(TestModel.objects.all().count(), 0)
+
+    @tag('e')
+    def test_import_deserialize_tx_queue(self):
+        """Asserts the fused queue imports, deserializes and archives
+        in one stage.
+        """
+        with patch('edc_sync_files.transaction.transaction_file_sender.SSHClient',
+                   new=MockSSHClient):
+            TestModel.objects.using('client').create(f1=fake.name())
+            TestModel.objects.using('client').create(f1=fake.name())
+
+            tx_exporter = TransactionExporter(
+                export_path=app_config.outgoing_folder,
+                using='client')
+            batch = tx_exporter.export_batch()
+
+            self.send(filenames=[batch.filename],
+                      history_model=tx_exporter.history_model)
+
+            queue = ImportDeserializeTransactionsFileQueue(
+                src_path=app_config.incoming_folder,
+                dst_path=app_config.archive_folder,
+                override_role=NODE_SERVER)
+            queue.put(os.path.join(app_config.incoming_folder, batch.filename))
+            queue.put(None)
+            process_queue(queue=queue)
+            queue.join()
+
+            self.assertEqual(TestModel.objects.all().count(), 2)
+            self.assertEqual(ImportedTransactionFileHistory.objects.filter(
+                batch_id=batch.batch_id, consumed=True).count(), 1)
+            self.assertTrue(os.path.exists(
+                os.path.join(app_config.archive_folder, batch.filename)))
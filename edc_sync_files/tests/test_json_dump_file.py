@@ -8,6 +8,8 @@ from edc_sync.models import OutgoingTransaction
 
 from ..models import ExportedTransactionFileHistory
 from ..transaction import TransactionExporterBatch, JSONDumpFile
+from ..transaction.manifest import Manifest
+from ..transaction.transaction_importer import JSONLoadFile
 from .models import TestModel
 
 
@@ -41,3 +43,30 @@ class TestJSONFile(TestCase):
         json_file.write()
         self.assertTrue(os.path.exists(
             os.path.join(json_file.path, json_file.name)))
+
+    def test_write_file_streams_in_chunks(self):
+        """Assert file written in chunks can be read by JSONLoadFile.
+        """
+        for _ in range(0, 3):
+            TestModel.objects.using('client').create(f1=fake.name())
+        batch = TransactionExporterBatch(using='client')
+        json_file = JSONDumpFile(batch=batch, path='/tmp', chunk_size=2)
+        json_file.write()
+        json_load_file = JSONLoadFile(name=json_file.name, path='/tmp')
+        self.assertEqual(
+            len([obj for obj in json_load_file.deserialized_objects]),
+            batch.count)
+
+    def test_write_file_manifest(self):
+        """Assert writes a manifest that matches the file.
+        """
+        batch = TransactionExporterBatch(using='client')
+        json_file = JSONDumpFile(batch=batch, path='/tmp')
+        json_file.write()
+        manifest = Manifest.read(path='/tmp', filename=json_file.name)
+        self.assertEqual(manifest.batch_id, batch.batch_id)
+        self.assertEqual(manifest.prev_batch_id, batch.prev_batch_id)
+        self.assertEqual(manifest.count, batch.count)
+        self.assertEqual(
+            manifest.size, os.path.getsize(os.path.join('/tmp', json_file.name)))
+        manifest.verify(path='/tmp')
@@ -45,3 +45,28 @@ class TestJSONLoadFile(TestCase):
         json_file = JSONLoadFile(name=self.filename, path=self.path)
         self.assertGreater(
             len([obj for obj in json_file.deserialized_objects]), 0)
+
+    def test_bad_json_file_incremental(self):
+        """Assert malformed JSON raises with the byte offset when
+        parsed incrementally.
+        """
+        _, p = tempfile.mkstemp()
+        with open(p, 'w') as f:
+            f.write('[{"a": 1} {"b": 2}]')
+        json_file = JSONLoadFile(
+            name=os.path.basename(p), path=os.path.dirname(p))
+        with self.assertRaises(JSONFileError) as cm:
+            [obj for obj in json_file.iter_objects()]
+        self.assertIn('byte offset 10', str(cm.exception))
+
+    def test_deserialize_file_incremental_matches(self):
+        """Assert incremental and non-incremental modes deserialize
+        the same objects.
+        """
+        json_file = JSONLoadFile(name=self.filename, path=self.path)
+        incremental = [obj.object.pk for obj in json_file.deserialized_objects]
+        json_file = JSONLoadFile(
+            name=self.filename, path=self.path, incremental=False)
+        self.assertEqual(
+            incremental,
+            [obj.object.pk for obj in json_file.deserialized_objects])
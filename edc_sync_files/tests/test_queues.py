@@ -2,8 +2,12 @@ import logging
 import os
 import re
 import tempfile
+import threading
+import time
 
+from datetime import timedelta
 from django.apps import apps as django_apps
+from django.db.utils import OperationalError
 from django.test import TestCase, tag
 
 from edc_device.constants import NODE_SERVER
@@ -11,12 +15,57 @@ from edc_sync.models import OutgoingTransaction, IncomingTransaction
 
 from ..models import ImportedTransactionFileHistory, ExportedTransactionFileHistory
 from ..file_queues import IncomingTransactionsFileQueue, DeserializeTransactionsFileQueue, process_queue
+from ..file_queues import DeduplicatingQueueMixin, process_queue_concurrently
+from ..file_queues.base_file_queue import BaseFileQueue
 from ..transaction import TransactionExporter, TransactionImporter
 from .models import TestModel
 
 logger = logging.getLogger('edc_sync_files')
 
 
+class RecordingFileQueue(BaseFileQueue):
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.processed = []
+        self.lock = threading.Lock()
+
+    def next_task(self, item, **kwargs):
+        time.sleep(0.01)
+        with self.lock:
+            self.processed.append(item)
+
+
+class DeduplicatingRecordingFileQueue(DeduplicatingQueueMixin, RecordingFileQueue):
+    pass
+
+
+class RacingFileQueue(RecordingFileQueue):
+
+    """Puts `racing_item` from another thread, like the watchdog
+    handler, while the scan is putting its first item.
+    """
+
+    racing_item = None
+
+    def put(self, item, block=True, timeout=None):
+        super().put(item, block=block, timeout=timeout)
+        if self.racing_item and getattr(self.local, 'scanning', False):
+            racing_item, self.racing_item = self.racing_item, None
+            thread = threading.Thread(target=self.put, args=(racing_item, ))
+            thread.start()
+            thread.join()
+
+
+class FailingFileQueue(BaseFileQueue):
+
+    def next_task(self, item, **kwargs):
+        try:
+            raise OSError('connection refused')
+        except OSError as e:
+            raise OperationalError(e) from e
+
+
 class TestQueues(TestCase):
 
     multi_db = True
@@ -166,3 +215,288 @@ class TestQueues(TestCase):
         self.assertEqual(q.unfinished_tasks, 0)
         self.assertEqual(
             TestModel.objects.filter(f1='model1').count(), 1)
+
+    def test_incoming_tx_queue_parks_out_of_sequence_file(self):
+        """Asserts a file that arrives before its predecessor is
+        parked and imported once the predecessor is imported.
+        """
+        ExportedTransactionFileHistory.objects.using('client').all().delete()
+        ImportedTransactionFileHistory.objects.all().delete()
+        OutgoingTransaction.objects.using('client').all().delete()
+        IncomingTransaction.objects.all().delete()
+        export_path = os.path.join(tempfile.gettempdir(), 'outgoing')
+        if not os.path.exists(export_path):
+            os.mkdir(export_path)
+        filenames = []
+        for _ in range(0, 2):
+            TestModel.objects.using('client').create(f1='model1')
+            tx_exporter = TransactionExporter(
+                export_path=export_path, using='client')
+            batch = tx_exporter.export_batch()
+            for f in [batch.filename, f'{batch.filename}.manifest']:
+                os.rename(
+                    os.path.join(export_path, f),
+                    os.path.join(self.src_path, f))
+            filenames.append(batch.filename)
+        q = IncomingTransactionsFileQueue(
+            src_path=self.src_path,
+            dst_path=self.dst_path)
+        q.next_task(os.path.join(self.src_path, filenames[1]))
+        self.assertEqual(len(q.reorder_buffer), 1)
+        self.assertEqual(q.qsize(), 0)
+        q.next_task(os.path.join(self.src_path, filenames[0]))
+        self.assertEqual(len(q.reorder_buffer), 0)
+        self.assertEqual(q.get(), os.path.join(self.src_path, filenames[1]))
+        q.next_task(os.path.join(self.src_path, filenames[1]))
+        self.assertEqual(ImportedTransactionFileHistory.objects.filter(
+            filename__in=filenames).count(), 2)
+
+    def test_incoming_tx_queue_reports_stale_parked_file_while_idle(self):
+        """Asserts a parked file is reported as stale even if no
+        further files arrive.
+        """
+        q = IncomingTransactionsFileQueue(
+            src_path=self.src_path,
+            dst_path=self.dst_path,
+            max_parked_age=timedelta(microseconds=1))
+        q.report_interval = 0.01
+        q.reorder_buffer.park(
+            filename='984020250101120000000002.json',
+            batch_id='984020250101120000000002',
+            prev_batch_id='984020250101120000000001')
+        with self.assertLogs(logger=logger, level=logging.WARNING):
+            q.startup()
+            try:
+                time.sleep(0.1)
+            finally:
+                q.shutdown()
+
+    def test_partition_key(self):
+        q = BaseFileQueue(src_path=self.src_path, dst_path=self.dst_path)
+        self.assertEqual(
+            q.partition_key('/tmp/984020250101120000123456.json.gz'), '9840')
+        self.assertEqual(
+            q.partition_key('host_20170101120000.json'), 'host')
+        self.assertEqual(q.partition_key('file.json'), 'file.json')
+
+    def test_process_queue_concurrently_keeps_producer_order(self):
+        q = RecordingFileQueue(src_path=self.src_path, dst_path=self.dst_path)
+        items = []
+        for index in range(0, 10):
+            for producer in ['9840', '9841', '9842']:
+                items.append(f'{producer}2025010112000000{index:04d}.json')
+        for item in items:
+            q.put(item)
+        q.put(None)
+        process_queue_concurrently(queue=q, workers=3)
+        self.assertEqual(q.unfinished_tasks, 0)
+        self.assertEqual(sorted(q.processed), sorted(items))
+        for producer in ['9840', '9841', '9842']:
+            self.assertEqual(
+                [item for item in q.processed if item.startswith(producer)],
+                [item for item in items if item.startswith(producer)])
+
+    def test_process_queue_quarantines_and_continues(self):
+        """Asserts a corrupt file is quarantined with an error record
+        and the queue continues.
+        """
+        quarantine_path = os.path.join(tempfile.gettempdir(), 'quarantine')
+        if not os.path.exists(quarantine_path):
+            os.mkdir(quarantine_path)
+        filenames = ['corrupt1.json', 'corrupt2.json']
+        for filename in filenames:
+            with open(os.path.join(self.src_path, filename), 'w') as f:
+                f.write('[{"model": ')
+        q = IncomingTransactionsFileQueue(
+            src_path=self.src_path,
+            dst_path=self.dst_path,
+            quarantine_path=quarantine_path)
+        for filename in filenames:
+            q.put(os.path.join(self.src_path, filename))
+        q.put(None)
+        process_queue(queue=q)
+        self.assertEqual(q.unfinished_tasks, 0)
+        for filename in filenames:
+            self.assertFalse(os.path.exists(os.path.join(self.src_path, filename)))
+            self.assertTrue(os.path.exists(os.path.join(quarantine_path, filename)))
+            self.assertTrue(os.path.exists(
+                os.path.join(quarantine_path, f'{filename}.error')))
+
+    def test_process_queue_retries_transient_error(self):
+        q = FailingFileQueue(
+            src_path=self.src_path, dst_path=self.dst_path, backoff=0.01)
+        q.put('file.json')
+        q.put(None)
+        process_queue(queue=q)
+        self.assertEqual(q.attempts, {'file.json': 1})
+        self.assertEqual(q.get(timeout=1), 'file.json')
+
+    def test_journal_records_items(self):
+        journal_path = os.path.join(tempfile.mkdtemp(), 'journal.sqlite3')
+        q = RecordingFileQueue(
+            src_path=self.src_path, dst_path=self.dst_path,
+            journal_path=journal_path)
+        q.put('file1.json')
+        q.put(None)
+        process_queue(queue=q)
+        self.assertEqual(q.journal.status('file1.json'), 'done')
+        self.assertEqual(q.journal.pending(), [])
+        self.assertIn('done', q.journal.timings())
+
+    def test_journal_resumes_pending_items(self):
+        journal_path = os.path.join(tempfile.mkdtemp(), 'journal.sqlite3')
+        for filename in ['file1.json', 'file2.json']:
+            with open(os.path.join(self.src_path, filename), 'w') as f:
+                f.write('[]')
+        q = RecordingFileQueue(
+            src_path=self.src_path, dst_path=self.dst_path,
+            journal_path=journal_path)
+        q.put(os.path.join(self.src_path, 'file2.json'))
+        q.journal.close()
+        # restart
+        q = RecordingFileQueue(
+            src_path=self.src_path, dst_path=self.dst_path,
+            journal_path=journal_path)
+        thread = q.reload(regexes=self.regexes)
+        self.assertEqual(q.get(), os.path.join(self.src_path, 'file2.json'))
+        thread.join()
+        self.assertEqual(q.get(), os.path.join(self.src_path, 'file1.json'))
+        self.assertEqual(q.qsize(), 0)
+
+    def test_journal_fails_missing_and_prunes_finished_items(self):
+        journal_path = os.path.join(tempfile.mkdtemp(), 'journal.sqlite3')
+        q = RecordingFileQueue(
+            src_path=self.src_path, dst_path=self.dst_path,
+            journal_path=journal_path)
+        q.put('file1.json')
+        q.journal.done('file1.json')
+        q.put(os.path.join(self.src_path, 'missing.json'))
+        q.journal.retention = 0.001
+        time.sleep(0.01)
+        q.reload(regexes=self.regexes).join()
+        self.assertIsNone(q.journal.status('file1.json'))
+        self.assertEqual(q.journal.status('missing.json'), 'failed')
+        self.assertEqual(q.journal.pending(), [])
+
+    def test_reload_in_timestamp_order(self):
+        filenames = ['984020250101120000000002.json', 'host_20240101120000.json',
+                     '984120250101120000000001.json']
+        for filename in filenames:
+            with open(os.path.join(self.src_path, filename), 'w') as f:
+                f.write('[]')
+        q = RecordingFileQueue(src_path=self.src_path, dst_path=self.dst_path)
+        q.reload(regexes=self.regexes)
+        self.assertEqual(
+            [os.path.basename(q.get()) for _ in range(0, 3)],
+            [filenames[1], filenames[2], filenames[0]])
+
+    def test_reload_skips_items_put_since_startup(self):
+        for filename in ['file1.json', 'file2.json']:
+            with open(os.path.join(self.src_path, filename), 'w') as f:
+                f.write('[]')
+        q = RecordingFileQueue(src_path=self.src_path, dst_path=self.dst_path)
+        q.startup()
+        q.put('file1.json')
+        q.reload(background=True, regexes=self.regexes).join()
+        self.assertEqual(q.qsize(), 2)
+        self.assertIsNone(q.scanned)
+
+    def test_reload_holds_items_put_during_scan(self):
+        """Asserts files put by another thread while the folder is
+        scanned do not overtake older files in the folder.
+        """
+        filenames = [f'98402025010112000000000{index}.json' for index in range(1, 6)]
+        for filename in filenames[:4]:
+            with open(os.path.join(self.src_path, filename), 'w') as f:
+                f.write('[]')
+        q = RacingFileQueue(src_path=self.src_path, dst_path=self.dst_path)
+        q.startup()
+        q.put(os.path.join(self.src_path, filenames[3]))
+        q.racing_item = os.path.join(self.src_path, filenames[4])
+        q.reload(background=True, regexes=self.regexes).join()
+        self.assertEqual(
+            [os.path.basename(q.get()) for _ in range(0, 5)], filenames)
+        self.assertEqual(q.qsize(), 0)
+        q.put('file.json')
+        self.assertEqual(q.qsize(), 1)
+
+    def test_deduplicating_queue(self):
+        q = DeduplicatingRecordingFileQueue(
+            src_path=self.src_path, dst_path=self.dst_path)
+        q.put(os.path.join(self.src_path, 'file1.json'))
+        q.put('file1.json')
+        q.put('file2.json')
+        self.assertEqual(q.qsize(), 2)
+        item = q.get()
+        q.task_started(item)
+        q.put('file1.json')
+        self.assertEqual(q.qsize(), 1)
+        q.task_succeeded(item)
+        q.task_done()
+        q.put('file1.json')
+        self.assertEqual(q.qsize(), 2)
+
+    def test_deserialize_tx_queue_takes_group(self):
+        q = DeserializeTransactionsFileQueue(
+            src_path=self.src_path,
+            dst_path=self.dst_path,
+            history_model=ImportedTransactionFileHistory,
+            group_size=3)
+        items = ['984020250101120000000001.json', '984120250101120000000001.json',
+                 '984020250101120000000002.json', '984020250101120000000003.json',
+                 '984020250101120000000004.json']
+        for item in items:
+            q.put(item)
+        item = q.get()
+        self.assertEqual(q.take_group(item), [items[2], items[3]])
+        self.assertEqual(list(q.queue), [items[1], items[4]])
+
+    def test_deserialize_tx_queue_defers_successors_of_failed_item(self):
+        q = DeserializeTransactionsFileQueue(
+            src_path=self.src_path,
+            dst_path=self.dst_path,
+            history_model=ImportedTransactionFileHistory,
+            group_size=3)
+        items = ['984020250101120000000001.json', '984120250101120000000001.json',
+                 '984020250101120000000002.json', '984020250101120000000003.json']
+        for item in items:
+            q.put(item)
+        item = q.get()
+        q.take_group(item)
+        q.defer(item, [items[2], items[3]])
+        self.assertEqual(list(q.queue), [items[1]])
+        q.release(item)
+        q.put(item)
+        self.assertEqual(list(q.queue), [items[1], item, items[2], items[3]])
+
+    def test_deserialize_tx_queue_group_in_chain_order(self):
+        self.make_import_tx_history(count=3)
+        items = [os.path.join(self.src_path, obj.filename)
+                 for obj in ImportedTransactionFileHistory.objects.order_by('created')]
+        q = DeserializeTransactionsFileQueue(
+            src_path=self.src_path,
+            dst_path=self.dst_path,
+            history_model=ImportedTransactionFileHistory,
+            group_size=4)
+        missing = os.path.join(self.src_path, 'missing.json')
+        with self.assertNumQueries(1):
+            group = q.get_histories([items[1], missing, items[0], items[2]])
+        self.assertEqual([item for item, _ in group], items + [missing])
+        self.assertIsNone(group[-1][1])
+
+    def test_deserialize_tx_queue_group_task_without_tx(self):
+        django_apps.app_configs['edc_device'].device_id = '98'
+        django_apps.app_configs['edc_device'].device_role = NODE_SERVER
+        self.make_import_tx_history(count=5)
+        q = DeserializeTransactionsFileQueue(
+            src_path=self.src_path,
+            dst_path=self.dst_path,
+            history_model=ImportedTransactionFileHistory,
+            override_role=NODE_SERVER,
+            group_size=5)
+        q.reload(regexes=self.regexes)
+        q.put(None)
+        process_queue(queue=q)
+        self.assertEqual(q.unfinished_tasks, 0)
+        self.assertEqual(ImportedTransactionFileHistory.objects.filter(
+            consumed=True).count(), 5)
@@ -1,16 +1,19 @@
 import os
 
+from datetime import timedelta
 from django.test.testcases import TestCase
 from django.test.utils import tag
+from edc_base.utils import get_utcnow
 from faker import Faker
 
 from edc_sync.models import OutgoingTransaction
 
-from ..models import ExportedTransactionFileHistory
+from ..models import ExportedTransactionChainHead, ExportedTransactionFileHistory
+from ..models import ExportedTransactionWatermark
 from ..transaction import TransactionExporter, TransactionExporterError
 from ..transaction import TransactionExporterBatch
 from ..transaction.transaction_exporter import BatchAlreadyOpen, HistoryAlreadyExists
-from .models import TestModel
+from .models import TestModel, TestModelChild
 import tempfile
 
 
@@ -221,3 +224,245 @@ class TestTransactionExporter2(TestCase):
                 'client').filter(batch_id=batches[2].batch_id):
             self.assertEqual(
                 batches[1].batch_id, obj.prev_batch_id)
+
+    def test_chain_head(self):
+        """Assert chain head is moved to the last exported batch.
+        """
+        tx_exporter = TransactionExporter(
+            export_path=self.export_path,
+            using='client')
+        for _ in range(0, 2):
+            TestModel.objects.using('client').create(f1=fake.name())
+            batch = tx_exporter.export_batch()
+            chain_head = ExportedTransactionChainHead.objects.using(
+                'client').get(device_id=batch.device_id, using='client')
+            self.assertEqual(chain_head.batch_id, batch.batch_id)
+
+    def test_chain_head_not_moved_if_none_pending(self):
+        """Assert chain head is not moved if nothing is exported.
+        """
+        TestModel.objects.using('client').create(f1=fake.name())
+        tx_exporter = TransactionExporter(
+            export_path=self.export_path,
+            using='client')
+        batch = tx_exporter.export_batch()
+        self.assertIsNone(tx_exporter.export_batch())
+        chain_head = ExportedTransactionChainHead.objects.using(
+            'client').get(device_id=batch.device_id, using='client')
+        self.assertEqual(chain_head.batch_id, batch.batch_id)
+
+    def test_prev_batch_id_from_legacy_history(self):
+        """Assert takes prev batch id from the history if there
+        is no chain head.
+        """
+        TestModel.objects.using('client').create(f1=fake.name())
+        tx_exporter = TransactionExporter(
+            export_path=self.export_path,
+            using='client')
+        batch_id = tx_exporter.export_batch().batch_id
+        ExportedTransactionChainHead.objects.using('client').all().delete()
+        TestModel.objects.using('client').create(f1=fake.name())
+        batch = tx_exporter.export_batch()
+        self.assertEqual(batch.prev_batch_id, batch_id)
+
+
+@tag('exporter')
+class TestTransactionExporterCapped(TestCase):
+
+    databases = '__all__'
+
+    def setUp(self):
+        ExportedTransactionFileHistory.objects.using('client').all().delete()
+        OutgoingTransaction.objects.using('client').all().delete()
+        TestModel.objects.using('client').all().delete()
+        self.export_path = os.path.join(tempfile.gettempdir(), 'export')
+        if not os.path.exists(self.export_path):
+            os.mkdir(self.export_path)
+        for _ in range(0, 5):
+            TestModel.objects.using('client').create(f1=fake.name())
+
+    def test_batch_max_count(self):
+        """Assert batch takes no more than max_count txs.
+        """
+        batch = TransactionExporterBatch(using='client', max_count=2)
+        self.assertEqual(batch.count, 2)
+
+    def test_batch_max_bytes(self):
+        """Assert batch takes at least one tx regardless of max_bytes.
+        """
+        batch = TransactionExporterBatch(using='client', max_bytes=1)
+        self.assertEqual(batch.count, 1)
+
+    def test_export_batches_max_count(self):
+        """Assert exports all pending txs to several files, in order,
+        each chained to the previous.
+        """
+        pending = OutgoingTransaction.objects.using('client').filter(
+            is_consumed_server=False).count()
+        tx_exporter = TransactionExporter(
+            export_path=self.export_path,
+            using='client', max_count=2)
+        batches = tx_exporter.export_batches()
+        self.assertEqual(len(batches), (pending + 1) // 2)
+        self.assertEqual(
+            OutgoingTransaction.objects.using('client').filter(
+                is_consumed_server=False).count(), 0)
+        for index, batch in enumerate(batches[1:]):
+            self.assertEqual(batch.prev_batch_id, batches[index].batch_id)
+            self.assertTrue(os.path.exists(
+                os.path.join(self.export_path, batch.filename)))
+
+
+@tag('watermark')
+class TestExportWatermark(TestCase):
+
+    databases = '__all__'
+
+    def setUp(self):
+        ExportedTransactionFileHistory.objects.using('client').all().delete()
+        ExportedTransactionWatermark.objects.using('client').all().delete()
+        OutgoingTransaction.objects.using('client').all().delete()
+        TestModel.objects.using('client').all().delete()
+        self.export_path = os.path.join(tempfile.gettempdir(), 'export')
+        if not os.path.exists(self.export_path):
+            os.mkdir(self.export_path)
+        TestModel.objects.using('client').create(f1=fake.name())
+
+    def test_export_updates_watermark(self):
+        """Assert export moves the watermark to the last exported tx.
+        """
+        tx_exporter = TransactionExporter(
+            export_path=self.export_path, using='client')
+        batch = tx_exporter.export_batch()
+        watermark = ExportedTransactionWatermark.objects.using(
+            'client').get(using='client')
+        last = OutgoingTransaction.objects.using('client').filter(
+            batch_id=batch.batch_id).order_by('-created').first()
+        self.assertEqual(watermark.last_created, last.created)
+
+    def test_batch_finds_tx_behind_watermark(self):
+        """Assert pending txs behind the watermark are selected
+        with a full scan once the watermark check is due.
+        """
+        tx_exporter = TransactionExporter(
+            export_path=self.export_path, using='client')
+        tx_exporter.export_batch()
+        watermark = ExportedTransactionWatermark.objects.using(
+            'client').get(using='client')
+        TestModel.objects.using('client').create(f1=fake.name())
+        OutgoingTransaction.objects.using('client').filter(
+            is_consumed_server=False).update(
+                created=watermark.last_created - timedelta(days=1))
+        ExportedTransactionWatermark.objects.using('client').filter(
+            pk=watermark.pk).update(checked_datetime=get_utcnow())
+        batch = TransactionExporterBatch(using='client')
+        self.assertIsNone(batch.batch_id)
+        ExportedTransactionWatermark.objects.using('client').filter(
+            pk=watermark.pk).update(
+                checked_datetime=get_utcnow() - timedelta(hours=2))
+        with self.assertLogs(logger='edc_sync_files', level='WARNING'):
+            batch = TransactionExporterBatch(using='client')
+        self.assertIsNotNone(batch.batch_id)
+        batch.close()
+        self.assertEqual(
+            ExportedTransactionWatermark.objects.using('client').get(
+                using='client').last_created, watermark.last_created)
+
+
+@tag('coalesce')
+class TestExportCoalesce(TestCase):
+
+    databases = '__all__'
+
+    def setUp(self):
+        ExportedTransactionFileHistory.objects.using('client').all().delete()
+        OutgoingTransaction.objects.using('client').all().delete()
+        TestModel.objects.using('client').all().delete()
+        self.export_path = os.path.join(tempfile.gettempdir(), 'export')
+        if not os.path.exists(self.export_path):
+            os.mkdir(self.export_path)
+
+    def test_coalesce_updates(self):
+        """Assert keeps only the first and last tx per record.
+        """
+        obj = TestModel.objects.using('client').create(f1=fake.name()[0:10])
+        for index in range(0, 3):
+            obj.f2 = str(index)
+            obj.save(using='client')
+        txs = OutgoingTransaction.objects.using('client').filter(
+            tx_pk=obj.pk).order_by('created', 'timestamp')
+        batch = TransactionExporterBatch(using='client')
+        coalesced = batch.coalesce()
+        self.assertGreater(coalesced, 0)
+        exported = [obj for obj in batch.iterator()]
+        self.assertEqual(len(exported), batch.count - coalesced)
+        self.assertEqual(
+            [o.pk for o in exported if str(o.tx_pk) == str(obj.pk)],
+            [txs.first().pk, txs.last().pk])
+
+    def test_coalesce_insert_and_delete(self):
+        """Assert drops all txs for a record inserted and deleted
+        within the batch.
+        """
+        TestModel.objects.using('client').create(f1=fake.name()[0:10])
+        obj = TestModel.objects.using('client').create(f1=fake.name()[0:10])
+        obj.delete()
+        batch = TransactionExporterBatch(using='client')
+        batch.coalesce()
+        self.assertNotIn(
+            str(obj.pk), [str(o.tx_pk) for o in batch.iterator()])
+
+    def test_coalesce_keeps_delete_of_child_before_parent(self):
+        """Assert the delete of a PROTECTed child is exported before
+        the delete of its parent updated earlier in the batch.
+        """
+        obj = TestModel.objects.using('client').create(f1=fake.name()[0:10])
+        child = TestModelChild.objects.using('client').create(
+            test_model=obj, f1=fake.name()[0:10])
+        OutgoingTransaction.objects.using('client').update(is_consumed_server=True)
+        obj.f2 = 'updated'
+        obj.save(using='client')
+        child.delete()
+        obj.delete()
+        batch = TransactionExporterBatch(using='client')
+        batch.coalesce()
+        tx_pks = [str(o.tx_pk) for o in batch.iterator()]
+        self.assertEqual(tx_pks.count(str(obj.pk)), 2)
+        self.assertLess(
+            tx_pks.index(str(child.pk)),
+            len(tx_pks) - 1 - tx_pks[::-1].index(str(obj.pk)))
+
+    def test_coalesce_keeps_fk_target_before_update(self):
+        """Assert the last tx of a record is exported after the
+        insert of a record it refers to.
+        """
+        obj = TestModel.objects.using('client').create(f1=fake.name()[0:10])
+        child = TestModelChild.objects.using('client').create(
+            test_model=obj, f1=fake.name()[0:10])
+        other = TestModel.objects.using('client').create(f1=fake.name()[0:10])
+        child.test_model = other
+        child.save(using='client')
+        last = OutgoingTransaction.objects.using('client').filter(
+            tx_pk=child.pk).order_by('created', 'timestamp').last()
+        batch = TransactionExporterBatch(using='client')
+        batch.coalesce()
+        exported = [o for o in batch.iterator()]
+        tx_pks = [str(o.tx_pk) for o in exported]
+        self.assertLess(
+            tx_pks.index(str(other.pk)),
+            [o.pk for o in exported].index(last.pk))
+
+    def test_coalesce_records_history(self):
+        """Assert exporter records number of coalesced txs in history.
+        """
+        obj = TestModel.objects.using('client').create(f1=fake.name()[0:10])
+        obj.f2 = 'updated'
+        obj.save(using='client')
+        tx_exporter = TransactionExporter(
+            export_path=self.export_path, using='client', coalesce=True)
+        batch = tx_exporter.export_batch()
+        history = ExportedTransactionFileHistory.objects.using(
+            'client').get(batch_id=batch.batch_id)
+        self.assertGreater(history.coalesced, 0)
+        self.assertEqual(OutgoingTransaction.objects.using('client').filter(
+            batch_id=batch.batch_id, is_consumed_server=False).count(), 0)
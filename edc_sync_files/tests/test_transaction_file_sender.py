@@ -1,4 +1,5 @@
 import os
+import shutil
 import tempfile
 from unittest.mock import patch
 
@@ -7,6 +8,8 @@ from django.test import TestCase, tag
 
 from .servers import MockSSHClient, MockSSHClientWithError
 from ..models import ExportedTransactionFileHistory
+from ..sftp_client import SFTPClient
+from ..ssh_client import SSHConnectionPool
 from ..transaction import TransactionFileSender, TransactionFileSenderError
 
 
@@ -131,3 +134,108 @@ class TestTransactionFileSender(TestCase):
                 dst_path=app_config.incoming_folder,
                 archive_path=app_config.archive_folder)
             self.assertEqual(tx_file_sender.ssh_client.username, username)
+
+    def test_send_persistent_reuses_connection(self):
+        with patch('edc_sync_files.transaction.transaction_file_sender.SSHClient',
+                   new=MockSSHClient):
+            app_config = django_apps.get_app_config('edc_sync_files')
+            tx_file_sender = TransactionFileSender(
+                history_model=ExportedTransactionFileHistory,
+                update_history_model=False, persistent=True,
+                src_path=app_config.outgoing_folder,
+                dst_tmp=app_config.tmp_folder,
+                dst_path=app_config.incoming_folder,
+                archive_path=app_config.archive_folder)
+            tx_file_sender.connection_pool = SSHConnectionPool()
+            for _ in range(2):
+                _, src = tempfile.mkstemp(
+                    text=True, dir=app_config.outgoing_folder)
+                tx_file_sender.send(filenames=[os.path.basename(src)])
+                self.assertTrue(tx_file_sender.ssh_client.connected)
+            self.assertEqual(len(tx_file_sender.connection_pool.connections), 1)
+            tx_file_sender.close()
+            self.assertFalse(tx_file_sender.ssh_client.connected)
+            self.assertEqual(len(tx_file_sender.connection_pool.connections), 0)
+
+    def test_send_persistent_reconnects_dead_connection(self):
+        with patch('edc_sync_files.transaction.transaction_file_sender.SSHClient',
+                   new=MockSSHClient):
+            app_config = django_apps.get_app_config('edc_sync_files')
+            tx_file_sender = TransactionFileSender(
+                history_model=ExportedTransactionFileHistory,
+                update_history_model=False, persistent=True,
+                src_path=app_config.outgoing_folder,
+                dst_tmp=app_config.tmp_folder,
+                dst_path=app_config.incoming_folder,
+                archive_path=app_config.archive_folder)
+            tx_file_sender.connection_pool = SSHConnectionPool()
+            tx_file_sender.connect()
+            # transport dropped
+            tx_file_sender.ssh_client.close()
+            _, src = tempfile.mkstemp(text=True, dir=app_config.outgoing_folder)
+            src_filename = os.path.basename(src)
+            tx_file_sender.send(filenames=[src_filename])
+            self.assertTrue(tx_file_sender.ssh_client.connected)
+            self.assertTrue(os.path.exists(
+                os.path.join(app_config.archive_folder, src_filename)))
+
+    def test_send_concurrently(self):
+        with patch('edc_sync_files.transaction.transaction_file_sender.SSHClient',
+                   new=MockSSHClient):
+            app_config = django_apps.get_app_config('edc_sync_files')
+            filenames = []
+            for _ in range(5):
+                _, src = tempfile.mkstemp(text=True, dir=app_config.outgoing_folder)
+                filenames.append(os.path.basename(src))
+                ExportedTransactionFileHistory.objects.create(
+                    filename=filenames[-1], sent=False)
+            tx_file_sender = TransactionFileSender(
+                history_model=ExportedTransactionFileHistory,
+                channels=3,
+                src_path=app_config.outgoing_folder,
+                dst_tmp=app_config.tmp_folder,
+                dst_path=app_config.incoming_folder,
+                archive_path=app_config.archive_folder)
+            committed = []
+            commit = SFTPClient.commit
+
+            def record_commit(sftp_conn, filename=None):
+                commit(sftp_conn, filename=filename)
+                committed.append(filename)
+
+            with patch.object(SFTPClient, 'commit', new=record_commit):
+                tx_file_sender.send(filenames=filenames)
+            self.assertEqual(committed, filenames)
+            for filename in filenames:
+                self.assertTrue(os.path.exists(os.path.join(
+                    app_config.incoming_folder, filename)))
+                self.assertTrue(os.path.exists(os.path.join(
+                    app_config.archive_folder, filename)))
+            self.assertEqual(
+                ExportedTransactionFileHistory.objects.filter(
+                    filename__in=filenames, sent=True).count(), 5)
+
+    def test_send_skips_delivered(self):
+        with patch('edc_sync_files.transaction.transaction_file_sender.SSHClient',
+                   new=MockSSHClient):
+            app_config = django_apps.get_app_config('edc_sync_files')
+            _, src = tempfile.mkstemp(text=True, dir=app_config.outgoing_folder)
+            with open(src, 'w') as fd:
+                fd.write('erik' * 10000)
+            src_filename = os.path.basename(src)
+            # delivered by a run that failed before updating history
+            shutil.copy2(src, os.path.join(app_config.incoming_folder, src_filename))
+            ExportedTransactionFileHistory.objects.create(
+                filename=src_filename, sent=False)
+            tx_file_sender = TransactionFileSender(
+                history_model=ExportedTransactionFileHistory,
+                src_path=app_config.outgoing_folder,
+                dst_tmp=app_config.tmp_folder,
+                dst_path=app_config.incoming_folder,
+                archive_path=app_config.archive_folder)
+            tx_file_sender.send(filenames=[src_filename])
+            self.assertEqual(tx_file_sender.ssh_client.put_args, [])
+            self.assertTrue(os.path.exists(
+                os.path.join(app_config.archive_folder, src_filename)))
+            self.assertTrue(ExportedTransactionFileHistory.objects.get(
+                filename=src_filename).sent)
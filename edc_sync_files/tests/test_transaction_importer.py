@@ -5,16 +5,21 @@ import uuid
 from django.db.utils import IntegrityError
 from django.test.testcases import TestCase
 from django.test.utils import tag
-from edc_sync.models import OutgoingTransaction
+from edc_sync.models import IncomingTransaction, OutgoingTransaction
 from faker import Faker
 
 from edc_sync_files.transaction.transaction_importer import TransactionImporterError
 from .models import TestModel
-from ..models import ExportedTransactionFileHistory
+from ..constants import GZIP, XZ
+from ..models import ExportedTransactionFileHistory, ImportedTransactionFileHistory
+from ..models import ImportedTransactionFileCheckpoint
 from ..transaction import TransactionExporter, TransactionImporter, \
     TransactionImporterBatch
+from ..transaction.batch_history_index import BatchHistoryIndex
+from ..transaction.manifest import Manifest
 from ..transaction.transaction_importer import (BatchError, BatchHistory,
-                                                BatchHistoryError, BatchIsEmpty)
+                                                BatchHistoryError, BatchIsEmpty,
+                                                ImportCheckpoint, JSONLoadFile)
 
 fake = Faker()
 
@@ -83,6 +88,61 @@ class TestBatchHistory(TestCase):
             batch_id=self.options.get('batch_id')))
 
 
+@tag('batch_history')
+class TestBatchHistoryIndex(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.batch_ids = [uuid.uuid4().hex for _ in range(0, 3)]
+        batch_history = BatchHistory()
+        prev_batch_id = self.batch_ids[0]
+        for index, batch_id in enumerate(self.batch_ids):
+            batch_history.update(
+                filename=f'file{index}.txt',
+                batch_id=batch_id,
+                prev_batch_id=prev_batch_id,
+                producer='erik',
+                count=1)
+            prev_batch_id = batch_id
+
+    def test_index_not_loaded(self):
+        index = BatchHistoryIndex()
+        self.assertFalse(index.contains(batch_id=self.batch_ids[0]))
+        self.assertFalse(index.is_next(
+            batch_id=uuid.uuid4().hex, prev_batch_id=self.batch_ids[2]))
+
+    def test_index_load(self):
+        index = BatchHistoryIndex()
+        index.load()
+        for batch_id in self.batch_ids:
+            self.assertTrue(index.contains(batch_id=batch_id))
+        self.assertEqual(index.tails, {self.batch_ids[2]})
+        self.assertTrue(index.is_next(
+            batch_id=uuid.uuid4().hex, prev_batch_id=self.batch_ids[2]))
+        self.assertFalse(index.is_next(
+            batch_id=uuid.uuid4().hex, prev_batch_id=self.batch_ids[1]))
+
+    def test_index_is_bounded(self):
+        index = BatchHistoryIndex(max_size=2)
+        index.load()
+        self.assertFalse(index.contains(batch_id=self.batch_ids[0]))
+        batch_id = uuid.uuid4().hex
+        index.add(batch_id=batch_id, prev_batch_id=self.batch_ids[2])
+        self.assertEqual(len(index.batch_ids), 2)
+        self.assertEqual(index.tails, {batch_id})
+        self.assertFalse(index.is_next(
+            batch_id=batch_id, prev_batch_id=self.batch_ids[2]))
+
+    def test_batch_history_uses_index(self):
+        index = BatchHistoryIndex()
+        index.load()
+        batch_history = BatchHistory(index=index)
+        with self.assertNumQueries(0, using='default'):
+            self.assertTrue(batch_history.exists(batch_id=self.batch_ids[1]))
+            self.assertTrue(batch_history.is_next(
+                batch_id=uuid.uuid4().hex, prev_batch_id=self.batch_ids[2]))
+
+
 @tag('batch')
 class TestImportBatch(TestCase):
     databases = '__all__'
@@ -122,9 +182,11 @@ class TestTransactionImporter(TestCase):
             os.mkdir(self.import_path)
 
     def manually_move_export2import(self, filename):
-        os.rename(
-            os.path.join(self.export_path, filename),
-            os.path.join(self.import_path, filename))
+        for f in [f'{filename}.manifest', filename]:
+            if os.path.exists(os.path.join(self.export_path, f)):
+                os.rename(
+                    os.path.join(self.export_path, f),
+                    os.path.join(self.import_path, f))
 
     def test_export_and_import(self):
         """Asserts exports a file and, after manually moving,
@@ -141,6 +203,251 @@ class TestTransactionImporter(TestCase):
         batch = tx_importer.import_batch(filename=batch.filename)
         self.assertIsNotNone(batch.batch_id)
 
+    def test_import_keeps_saved_instances(self):
+        """Asserts the inserted instances are kept if keep_saved.
+        """
+        TestModel.objects.using('client').create(f1=fake.name())
+        TestModel.objects.using('client').create(f1=fake.name())
+        tx_exporter = TransactionExporter(
+            export_path=self.export_path,
+            using='client')
+        batch = tx_exporter.export_batch()
+        self.manually_move_export2import(batch.filename)
+        tx_importer = TransactionImporter(
+            import_path=self.import_path, keep_saved=True)
+        batch = tx_importer.import_batch(filename=batch.filename)
+        self.assertEqual(
+            sorted(str(obj.pk) for obj in batch.saved_objects),
+            sorted(str(pk) for pk in batch.saved_transactions.values_list(
+                'pk', flat=True)))
+        self.assertTrue(all(isinstance(obj, IncomingTransaction)
+                            for obj in batch.saved_objects))
+
+    def test_export_and_import_compressed(self):
+        """Asserts exports a compressed file and, after manually
+        moving, imports.
+        """
+        for compression, extension in [(GZIP, '.json.gz'), (XZ, '.json.xz')]:
+            TestModel.objects.using('client').create(f1=fake.name())
+            tx_exporter = TransactionExporter(
+                export_path=self.export_path,
+                using='client',
+                compression=compression)
+            batch = tx_exporter.export_batch()
+            self.assertTrue(batch.filename.endswith(extension))
+            self.manually_move_export2import(batch.filename)
+            tx_importer = TransactionImporter(import_path=self.import_path)
+            batch = tx_importer.import_batch(filename=batch.filename)
+            self.assertGreater(batch.count, 0)
+
+    def test_import_rejects_corrupt_file(self):
+        """Asserts raises if the file does not match its manifest.
+        """
+        TestModel.objects.using('client').create(f1=fake.name())
+        tx_exporter = TransactionExporter(
+            export_path=self.export_path,
+            using='client')
+        batch = tx_exporter.export_batch()
+        self.manually_move_export2import(batch.filename)
+        with open(os.path.join(self.import_path, batch.filename), 'a') as f:
+            f.write(' ')
+        tx_importer = TransactionImporter(import_path=self.import_path)
+        self.assertRaises(
+            TransactionImporterError,
+            tx_importer.import_batch, filename=batch.filename)
+
+    def test_import_rejects_duplicate_from_manifest(self):
+        """Asserts raises on a duplicate batch without reading the file.
+        """
+        TestModel.objects.using('client').create(f1=fake.name())
+        tx_exporter = TransactionExporter(
+            export_path=self.export_path,
+            using='client')
+        batch = tx_exporter.export_batch()
+        self.manually_move_export2import(batch.filename)
+        tx_importer = TransactionImporter(import_path=self.import_path)
+        tx_importer.import_batch(filename=batch.filename)
+        with open(os.path.join(self.import_path, batch.filename), 'w') as f:
+            f.write('][][][')
+        with self.assertRaises(TransactionImporterError) as cm:
+            tx_importer.import_batch(filename=batch.filename)
+        self.assertIn('already been processed', str(cm.exception))
+
+    def test_import_batch_saves_in_chunks(self):
+        """Asserts saves all objects across chunks and skips
+        objects that already exist.
+        """
+        for _ in range(0, 5):
+            TestModel.objects.using('client').create(f1=fake.name())
+        tx_exporter = TransactionExporter(
+            export_path=self.export_path,
+            using='client')
+        batch = tx_exporter.export_batch()
+        self.manually_move_export2import(batch.filename)
+        json_file = JSONLoadFile(name=batch.filename, path=self.import_path)
+        import_batch = TransactionImporterBatch(chunk_size=2)
+        import_batch.populate(
+            deserialized_txs=json_file.deserialized_objects,
+            filename=json_file.name)
+        self.assertEqual(import_batch.save(), import_batch.count)
+        self.assertEqual(
+            import_batch.saved_transactions.count(), import_batch.count)
+        self.assertFalse(import_batch.objects_unsaved)
+        self.assertEqual(import_batch.save(), 0)
+        self.assertEqual(import_batch.existing, import_batch.count)
+        self.assertFalse(import_batch.objects_unsaved)
+
+    def test_export_and_import_chunked(self):
+        """Asserts imports in chunks with exact history totals.
+        """
+        for _ in range(0, 5):
+            TestModel.objects.using('client').create(f1=fake.name())
+        tx_exporter = TransactionExporter(
+            export_path=self.export_path,
+            using='client')
+        batch = tx_exporter.export_batch()
+        self.manually_move_export2import(batch.filename)
+        tx_importer = TransactionImporter(
+            import_path=self.import_path, chunked=True, chunk_size=2)
+        batch = tx_importer.import_batch(filename=batch.filename)
+        self.assertFalse(batch.objects)
+        self.assertEqual(batch.saved_transactions.count(), batch.count)
+        history = ImportedTransactionFileHistory.objects.get(
+            batch_id=batch.batch_id)
+        self.assertEqual(history.total, batch.count)
+
+    def test_import_chunked_is_all_or_nothing(self):
+        """Asserts nothing is saved if a chunked import fails.
+        """
+        for _ in range(0, 5):
+            TestModel.objects.using('client').create(f1=fake.name())
+        tx_exporter = TransactionExporter(
+            export_path=self.export_path,
+            using='client')
+        batch = tx_exporter.export_batch()
+        self.manually_move_export2import(batch.filename)
+        manifest = Manifest.read(path=self.import_path, filename=batch.filename)
+        manifest.count += 1
+        manifest.write(path=self.import_path)
+        tx_importer = TransactionImporter(
+            import_path=self.import_path, chunked=True)
+        self.assertRaises(
+            TransactionImporterError,
+            tx_importer.import_batch, filename=batch.filename)
+        self.assertEqual(IncomingTransaction.objects.filter(
+            batch_id=batch.batch_id).count(), 0)
+
+    def test_import_resumes_from_checkpoint(self):
+        """Asserts an interrupted import resumes from its checkpoint.
+        """
+        for _ in range(0, 5):
+            TestModel.objects.using('client').create(f1=fake.name())
+        tx_exporter = TransactionExporter(
+            export_path=self.export_path,
+            using='client')
+        batch = tx_exporter.export_batch()
+        self.manually_move_export2import(batch.filename)
+        json_file = JSONLoadFile(name=batch.filename, path=self.import_path)
+        deserialized_txs = list(json_file.deserialized_objects)
+        import_batch = TransactionImporterBatch(chunk_size=2)
+        import_batch.save_chunked(
+            deserialized_txs=iter(deserialized_txs[:4]),
+            filename=batch.filename,
+            checkpoint=ImportCheckpoint())
+        checkpoint = ImportedTransactionFileCheckpoint.objects.get(
+            filename=batch.filename)
+        self.assertEqual(checkpoint.offset, 4)
+        tx_importer = TransactionImporter(
+            import_path=self.import_path, checkpoints=True, chunk_size=2)
+        import_batch = tx_importer.import_batch(filename=batch.filename)
+        self.assertEqual(import_batch.inserted, len(deserialized_txs) - 4)
+        self.assertEqual(import_batch.count, len(deserialized_txs))
+        history = ImportedTransactionFileHistory.objects.get(
+            batch_id=import_batch.batch_id)
+        self.assertEqual(history.total, len(deserialized_txs))
+        self.assertFalse(ImportedTransactionFileCheckpoint.objects.filter(
+            filename=batch.filename).exists())
+
+    def test_import_discards_checkpoint_not_matching_file(self):
+        for _ in range(0, 5):
+            TestModel.objects.using('client').create(f1=fake.name())
+        tx_exporter = TransactionExporter(
+            export_path=self.export_path,
+            using='client')
+        batch = tx_exporter.export_batch()
+        self.manually_move_export2import(batch.filename)
+        ImportCheckpoint().update(
+            filename=batch.filename, batch_id=batch.batch_id,
+            offset=2, last_pk=uuid.uuid4())
+        tx_importer = TransactionImporter(
+            import_path=self.import_path, checkpoints=True)
+        self.assertRaises(
+            TransactionImporterError,
+            tx_importer.import_batch, filename=batch.filename)
+        self.assertFalse(ImportedTransactionFileCheckpoint.objects.filter(
+            filename=batch.filename).exists())
+
+    def test_import_checks_checkpoint_at_offset_one(self):
+        for _ in range(0, 5):
+            TestModel.objects.using('client').create(f1=fake.name())
+        tx_exporter = TransactionExporter(
+            export_path=self.export_path,
+            using='client')
+        batch = tx_exporter.export_batch()
+        self.manually_move_export2import(batch.filename)
+        ImportCheckpoint().update(
+            filename=batch.filename, batch_id=batch.batch_id,
+            offset=1, last_pk=uuid.uuid4())
+        tx_importer = TransactionImporter(
+            import_path=self.import_path, checkpoints=True)
+        self.assertRaises(
+            TransactionImporterError,
+            tx_importer.import_batch, filename=batch.filename)
+        self.assertFalse(ImportedTransactionFileCheckpoint.objects.filter(
+            filename=batch.filename).exists())
+
+    def test_import_discards_checkpoint_beyond_end_of_file(self):
+        for _ in range(0, 5):
+            TestModel.objects.using('client').create(f1=fake.name())
+        tx_exporter = TransactionExporter(
+            export_path=self.export_path,
+            using='client')
+        batch = tx_exporter.export_batch()
+        self.manually_move_export2import(batch.filename)
+        ImportCheckpoint().update(
+            filename=batch.filename, batch_id=batch.batch_id,
+            offset=1000, last_pk=uuid.uuid4())
+        tx_importer = TransactionImporter(
+            import_path=self.import_path, checkpoints=True)
+        self.assertRaises(
+            TransactionImporterError,
+            tx_importer.import_batch, filename=batch.filename)
+        self.assertFalse(ImportedTransactionFileCheckpoint.objects.filter(
+            filename=batch.filename).exists())
+
+    def test_discard_deletes_checkpoint_and_partial_import(self):
+        for _ in range(0, 5):
+            TestModel.objects.using('client').create(f1=fake.name())
+        tx_exporter = TransactionExporter(
+            export_path=self.export_path,
+            using='client')
+        batch = tx_exporter.export_batch()
+        self.manually_move_export2import(batch.filename)
+        json_file = JSONLoadFile(name=batch.filename, path=self.import_path)
+        deserialized_txs = list(json_file.deserialized_objects)
+        TransactionImporterBatch(chunk_size=2).save_chunked(
+            deserialized_txs=iter(deserialized_txs[:4]),
+            filename=batch.filename,
+            checkpoint=ImportCheckpoint())
+        self.assertEqual(IncomingTransaction.objects.filter(
+            batch_id=batch.batch_id).count(), 4)
+        TransactionImporter(
+            import_path=self.import_path).discard(filename=batch.filename)
+        self.assertFalse(ImportedTransactionFileCheckpoint.objects.filter(
+            filename=batch.filename).exists())
+        self.assertEqual(IncomingTransaction.objects.filter(
+            batch_id=batch.batch_id).count(), 0)
+
     def test_export_and_import_many_in_order(self):
         for _ in range(0, 5):
             TestModel.objects.using('client').create(f1=fake.name())
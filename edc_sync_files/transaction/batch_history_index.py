@@ -0,0 +1,93 @@
+import threading
+
+from collections import OrderedDict
+from django.db.models import Exists, OuterRef
+
+from ..models import ImportedTransactionFileHistory
+
+
+class BatchHistoryIndex:
+
+    """An in-process index of imported batch_ids and chain tails
+    for the import queue worker.
+
+    A chain tail is a batch_id not yet followed by another batch.
+    Batch ids are kept in a bounded LRU so only positive answers
+    are trusted; callers fall back to the database on a miss.
+
+    The index is only used once loaded and is updated as history
+    is committed.
+    """
+
+    max_size = 10000
+
+    def __init__(self, model=None, max_size=None):
+        self.model = model or ImportedTransactionFileHistory
+        self.max_size = max_size or self.max_size
+        self.batch_ids = OrderedDict()
+        self.tails = set()
+        self.loaded = False
+        self.lock = threading.RLock()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(loaded={self.loaded})'
+
+    def load(self):
+        """Loads the most recent batch_ids and all chain tails
+        from the history model.
+        """
+        successors = self.model.objects.filter(
+            prev_batch_id=OuterRef('batch_id')).exclude(
+                batch_id=OuterRef('batch_id'))
+        with self.lock:
+            self.clear()
+            batch_ids = self.model.objects.exclude(
+                batch_id__isnull=True).order_by('-created').values_list(
+                    'batch_id', flat=True)[:self.max_size]
+            for batch_id in reversed(list(batch_ids)):
+                self.batch_ids[batch_id] = None
+            self.tails.update(
+                self.model.objects.exclude(batch_id__isnull=True).annotate(
+                    followed=Exists(successors)).filter(
+                        followed=False).values_list('batch_id', flat=True))
+            self.loaded = True
+
+    def clear(self):
+        with self.lock:
+            self.batch_ids.clear()
+            self.tails.clear()
+            self.loaded = False
+
+    def contains(self, batch_id=None):
+        """Returns True if batch_id is known to be in the history.
+        """
+        with self.lock:
+            if batch_id in self.batch_ids:
+                self.batch_ids.move_to_end(batch_id)
+                return True
+            return batch_id in self.tails
+
+    def is_next(self, batch_id=None, prev_batch_id=None):
+        """Returns True if prev_batch_id is a chain tail and batch_id
+        is not in the index, that is, batch_id is the next batch
+        in its chain.
+        """
+        with self.lock:
+            if not self.loaded or prev_batch_id == batch_id:
+                return False
+            return prev_batch_id in self.tails and not self.contains(batch_id)
+
+    def add(self, batch_id=None, prev_batch_id=None):
+        with self.lock:
+            if not self.loaded:
+                return
+            self.batch_ids[batch_id] = None
+            self.batch_ids.move_to_end(batch_id)
+            while len(self.batch_ids) > self.max_size:
+                self.batch_ids.popitem(last=False)
+            if prev_batch_id != batch_id:
+                self.tails.discard(prev_batch_id)
+            self.tails.add(batch_id)
+
+
+batch_history_index = BatchHistoryIndex()
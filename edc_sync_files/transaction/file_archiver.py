@@ -1,6 +1,8 @@
 import logging
 import os
 
+from ..constants import MANIFEST_SUFFIX
+
 
 class FileArchiverError(Exception):
     pass
@@ -43,6 +45,13 @@ class FileArchiver:
         return f'{self.src_path}, {self.dst_path}'
 
     def archive(self, filename):
+        """Moves the file, and its manifest if any, to the destination.
+        """
+        manifest = f'{filename}{MANIFEST_SUFFIX}'
+        if os.path.exists(os.path.join(self.src_path, manifest)):
+            os.rename(
+                os.path.join(self.src_path, manifest),
+                os.path.join(self.dst_path, manifest))
         os.rename(
             os.path.join(self.src_path, filename),
             os.path.join(self.dst_path, filename))
@@ -0,0 +1,62 @@
+import gzip
+import io
+import lzma
+
+from ..constants import GZIP, XZ
+
+extensions = {GZIP: '.gz', XZ: '.xz'}
+
+
+class FileCompressionError(Exception):
+    pass
+
+
+def get_extension(compression=None):
+    """Returns the filename extension for the compression or an
+    empty string if not compressed.
+    """
+    if not compression:
+        return ''
+    try:
+        return extensions[compression]
+    except KeyError:
+        raise FileCompressionError(
+            f'Invalid compression. Expected one of {list(extensions)}. '
+            f'Got {compression}')
+
+
+def get_compression(filename=None):
+    """Returns the compression given the filename or None.
+    """
+    for compression, extension in extensions.items():
+        if filename.endswith(extension):
+            return compression
+    return None
+
+
+def compressed(fileobj=None, compression=None, mode=None):
+    """Returns a binary file object that (de)compresses to/from
+    `fileobj` as it is written/read, or `fileobj` if not compressed.
+
+    Closing the returned file object does not close `fileobj`.
+    """
+    if compression == GZIP:
+        return gzip.GzipFile(fileobj=fileobj, mode=mode)
+    elif compression == XZ:
+        return lzma.LZMAFile(fileobj, mode=mode)
+    elif compression:
+        raise FileCompressionError(f'Invalid compression. Got {compression}')
+    return fileobj
+
+
+def open_text(path=None, compression=None):
+    """Returns a text file object for reading, decompressing
+    on the fly if the file is compressed.
+    """
+    if compression == GZIP:
+        return gzip.open(path, mode='rt', encoding='utf-8')
+    elif compression == XZ:
+        return lzma.open(path, mode='rt', encoding='utf-8')
+    elif compression:
+        raise FileCompressionError(f'Invalid compression. Got {compression}')
+    return io.open(path, mode='r', encoding='utf-8')
@@ -0,0 +1,102 @@
+import json
+
+
+class JSONArrayReaderError(Exception):
+
+    def __init__(self, message=None, offset=None):
+        super().__init__(f'{message} (byte offset {offset})')
+        self.offset = offset
+
+
+class JSONArrayReader:
+
+    """Reads the elements of a top-level JSON array from a text
+    stream one at a time, without reading the whole stream
+    into memory.
+
+    Malformed JSON raises JSONArrayReaderError with the byte
+    offset of the error.
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, stream=None, chunk_size=None):
+        self.stream = stream
+        self.chunk_size = chunk_size or self.chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.offset = 0
+        self.eof = False
+
+    def __iter__(self):
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+        else:
+            while True:
+                yield self.decode()
+                char = self.peek()
+                if char not in [',', ']']:
+                    self.raise_error(f'Expecting \',\' or \']\'. Got {char!r}')
+                self.pos += 1
+                if char == ']':
+                    break
+        if self.peek() is not None:
+            self.raise_error('Extra data after the array')
+
+    def read(self, size=None):
+        """Drops consumed text from the buffer and appends the
+        next chunk of text from the stream.
+        """
+        consumed = self.buffer[:self.pos]
+        self.offset += len(consumed) if consumed.isascii() else len(
+            consumed.encode('utf-8'))
+        chunk = self.stream.read(size or self.chunk_size)
+        self.eof = not chunk
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+
+    def peek(self):
+        """Skips whitespace and returns the next character or None
+        at the end of the stream.
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof:
+                return None
+            self.read()
+
+    def expect(self, char=None):
+        if self.peek() != char:
+            self.raise_error(f'Expecting {char!r}')
+        self.pos += 1
+
+    def decode(self):
+        """Returns the next JSON value in the buffer, reading more
+        of the stream until the value is complete.
+        """
+        size = self.chunk_size
+        self.peek()
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as e:
+                if self.eof:
+                    self.raise_error(e.msg, pos=e.pos)
+            else:
+                # a value that ends the buffer, e.g. a number,
+                # may continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return obj
+            self.read(size)
+            size *= 2
+
+    def raise_error(self, message=None, pos=None):
+        pos = self.pos if pos is None else pos
+        offset = self.offset + len(self.buffer[:pos].encode('utf-8'))
+        raise JSONArrayReaderError(message, offset=offset)
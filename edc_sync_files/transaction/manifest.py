@@ -0,0 +1,126 @@
+import hashlib
+import io
+import json
+import os
+
+from ..constants import MANIFEST_SUFFIX
+
+
+class ManifestError(Exception):
+    pass
+
+
+class HashingWriter(io.RawIOBase):
+
+    """A writable raw stream that passes bytes through to `fileobj`
+    while counting them and updating a sha256 hash.
+
+    Closing the writer does not close `fileobj`.
+    """
+
+    def __init__(self, fileobj=None):
+        super().__init__()
+        self.fileobj = fileobj
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.fileobj.write(b)
+        self.hash.update(b)
+        self.size += len(b)
+        return len(b)
+
+    @property
+    def sha256(self):
+        return self.hash.hexdigest()
+
+
+class Manifest:
+
+    """A small JSON sidecar describing a transaction file.
+
+    Written next to the transaction file as `<filename>.manifest`
+    so the receiver can validate the batch sequence and integrity
+    of a file without parsing it.
+    """
+
+    chunk_size = 1024 * 1024
+
+    def __init__(self, filename=None, batch_id=None, prev_batch_id=None,
+                 producer=None, count=None, size=None, sha256=None, **kwargs):
+        self.filename = filename
+        self.batch_id = batch_id
+        self.prev_batch_id = prev_batch_id
+        self.producer = producer
+        self.count = count
+        self.size = size
+        self.sha256 = sha256
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(filename={self.filename})'
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def name(self):
+        return f'{self.filename}{MANIFEST_SUFFIX}'
+
+    def to_dict(self):
+        return dict(
+            filename=self.filename,
+            batch_id=self.batch_id,
+            prev_batch_id=self.prev_batch_id,
+            producer=self.producer,
+            count=self.count,
+            size=self.size,
+            sha256=self.sha256)
+
+    def write(self, path=None):
+        try:
+            with open(os.path.join(path, self.name), 'w') as f:
+                json.dump(self.to_dict(), f)
+        except (OSError, TypeError) as e:
+            raise ManifestError(
+                f'Unable to write manifest. Got \'{e}\'') from e
+
+    @classmethod
+    def read(cls, path=None, filename=None):
+        """Returns a manifest instance for the transaction file or
+        None if the file has no manifest.
+        """
+        p = os.path.join(path, f'{filename}{MANIFEST_SUFFIX}')
+        try:
+            with open(p) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, json.JSONDecodeError) as e:
+            raise ManifestError(f'Invalid manifest. Got {e}. See {p}') from e
+        if not isinstance(data, dict) or data.get('filename') != filename:
+            raise ManifestError(f'Invalid manifest for \'{filename}\'. See {p}')
+        return cls(**data)
+
+    def verify(self, path=None):
+        """Raises ManifestError if the size or sha256 of the
+        transaction file does not match the manifest.
+        """
+        p = os.path.join(path, self.filename)
+        try:
+            size = os.path.getsize(p)
+        except OSError as e:
+            raise ManifestError(e) from e
+        if size != self.size:
+            raise ManifestError(
+                f'File size does not match manifest. Expected {self.size}. '
+                f'Got {size}. See {p}')
+        h = hashlib.sha256()
+        with open(p, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                h.update(chunk)
+        if h.hexdigest() != self.sha256:
+            raise ManifestError(
+                f'File checksum does not match manifest. See {p}')
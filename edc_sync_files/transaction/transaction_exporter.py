@@ -1,15 +1,28 @@
+import io
+import logging
 import os
 
+from datetime import timedelta
 from django.apps import apps as django_apps
+from django.core import serializers
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.functions import Length
 from django.utils import timezone
 
 from edc_base.utils import get_utcnow
 from edc_sync.models import OutgoingTransaction
 from edc_sync.transaction import serialize
 
-from ..models import ExportedTransactionFileHistory
+from ..constants import DELETE, INSERT
+from ..models import ExportedTransactionChainHead, ExportedTransactionFileHistory
+from ..models import ExportedTransactionWatermark
+from .file_compression import compressed, get_compression, get_extension
+from .manifest import HashingWriter, Manifest, ManifestError
 from django.contrib.sites.models import Site
 
+logger = logging.getLogger('edc_sync_files')
+
 
 class BatchAlreadyOpen(Exception):
     pass
@@ -40,17 +53,57 @@ class JSONDumpFileError(Exception):
 
 
 class JSONDumpFile:
-    def __init__(self, batch=None, path=None, **kwargs):
+
+    """Writes a batch of outgoing transactions to file as JSON.
+
+    Objects are fetched in chunks and serialized one at a time
+    directly to the file handle so memory stays flat regardless
+    of the size of the batch. If the batch filename has a
+    compression extension, the file is compressed as it is written.
+
+    A manifest with the count, size and sha256 of the file is
+    written alongside the file, see `Manifest`.
+    """
+
+    chunk_size = 2000
+
+    def __init__(self, batch=None, path=None, chunk_size=None, **kwargs):
+        self._json_txt = None
         self.batch = batch
+        self.chunk_size = chunk_size or self.chunk_size
+        self.count = 0
+        self.manifest = None
         self.name = self.batch.filename
+        self.producer = None
+        self.compression = get_compression(self.name) if self.name else None
         self.path = path
         self.serialize = serialize
-        self.json_txt = self.serialize(objects=self.batch.items)
+
+    @property
+    def json_txt(self):
+        """Returns the batch as JSON text.
+
+        Note: holds the entire batch in memory, `write` does not.
+        """
+        if self._json_txt is None:
+            self._json_txt = self.serialize(objects=self.batch.iterator())
+        return self._json_txt
 
     def write(self):
+        """Writes the batch to file and then writes the file's manifest.
+        """
+        self.count = 0
+        self.producer = None
         try:
-            with open(os.path.join(self.path, self.batch.filename), 'w') as f:
-                f.write(self.json_txt)
+            with open(os.path.join(self.path, self.batch.filename), 'wb') as f:
+                hashing_writer = HashingWriter(fileobj=f)
+                with io.BufferedWriter(hashing_writer) as buffered:
+                    with compressed(fileobj=buffered, compression=self.compression,
+                                    mode='wb') as fileobj:
+                        stream = io.TextIOWrapper(fileobj, encoding='utf-8')
+                        self.dump(stream=stream)
+                        stream.flush()
+                        stream.detach()
         except IOError as e:
             raise JSONDumpFileError(
                 f'Unable to write to file. Got \'{str(e)}\'')
@@ -58,30 +111,105 @@ class JSONDumpFile:
             raise JSONDumpFileError(
                 f'Unable to open/find file. path={self.path}, '
                 f'filename={self.batch.filename}. Got \'{str(e)}\'')
+        self.manifest = Manifest(
+            filename=self.name,
+            batch_id=self.batch.batch_id,
+            prev_batch_id=self.batch.prev_batch_id,
+            producer=self.producer,
+            count=self.count,
+            size=hashing_writer.size,
+            sha256=hashing_writer.sha256)
+        try:
+            self.manifest.write(path=self.path)
+        except ManifestError as e:
+            raise JSONDumpFileError(e) from e
+
+    def dump(self, stream=None):
+        """Serializes the batch, one object at a time, to the stream.
+
+        Uses the same serializer options as `edc_sync.transaction.serialize`
+        so the file can be read by `JSONLoadFile`.
+        """
+        serializers.serialize(
+            'json', self.objects(),
+            stream=stream,
+            ensure_ascii=True,
+            use_natural_foreign_keys=True,
+            use_natural_primary_keys=False)
+
+    def objects(self):
+        """Returns a generator of the batch objects that counts
+        the objects as they are serialized.
+        """
+        for obj in self.batch.iterator(chunk_size=self.chunk_size):
+            self.count += 1
+            self.producer = self.producer or obj.producer
+            yield obj
 
 
 class ExportBatch:
 
+    """A batch of pending outgoing transactions.
+
+    If `max_count` and/or `max_bytes` are set, the batch takes
+    the oldest pending transactions up to the limit and leaves
+    the rest for the next batch. `max_bytes` is measured on the
+    `tx` payload so is an approximation of the file size.
+
+    If `compression` is set, the filename takes the extension of the
+    compression, e.g. `.json.gz`.
+
+    Pending transactions are selected after the watermark, the
+    (created, pk) of the last exported transaction, instead of
+    scanning the whole table. Set `full_scan` to ignore the
+    watermark. At most once per `watermark_check_interval` the
+    batch checks for pending transactions behind the watermark,
+    e.g. from a long-running write committed late or after the
+    system clock was changed, and if any are found, logs a warning
+    and selects pending transactions with a full scan.
+
+    Call `coalesce` to leave out the transactions between the
+    first and last transaction for the same record.
+
+    The prev_batch_id is read from, and the new batch_id written to,
+    the chain head for this device, site and database in the same
+    database transaction as the pending transactions are updated.
+    """
+
+    update_chunk_size = 500
+    watermark_check_interval = timedelta(hours=1)
+
     def __init__(self, device_id=None, using=None, model=None,
-                 history_model=None, site_code=None, **kwargs):
+                 history_model=None, site_code=None, max_count=None,
+                 max_bytes=None, compression=None, watermark_model=None,
+                 full_scan=None, chain_head_model=None, **kwargs):
         edc_device_app_config = django_apps.get_app_config('edc_device')
         self.closed = False
         self.batch_id = None
+        self.chain_head_model = chain_head_model or ExportedTransactionChainHead
+        self.extension = f'.json{get_extension(compression)}'
         self.device_id = device_id or edc_device_app_config.device_id
         self.site_code = site_code or Site.objects.get_current()
         self.filename = None
+        self.full_scan = full_scan
         self.history = None
         self.history_model = history_model or ExportedTransactionFileHistory
+        self.last_created = None
+        self.last_pk = None
+        self.max_bytes = max_bytes
+        self.max_count = max_count
         self.model = model or OutgoingTransaction
         self.prev_batch_id = None
+        self.superseded = set()
         self.using = using
+        self.watermark_model = watermark_model or ExportedTransactionWatermark
         self.open()
 
     def reload(self, batch_id):
         obj = self.model.objects.using(self.using).get(batch_id=batch_id)
         self.batch_id = obj.batch_id
         self.prev_batch_id = obj.prev_batch_id
-        self.filename = f'{self.batch_id}.json'
+        self.filename = f'{self.batch_id}{self.extension}'
         self.history = self.history_model.objects.using(self.using).get(
             batch_id=self.batch_id)
 
@@ -90,22 +218,155 @@ class ExportBatch:
             raise BatchAlreadyOpen('Batch is already open.')
         timestamp = timezone.now().strftime("%Y%m%d%H%M%S%f")
         batch_id = f'{self.device_id}{self.site_code}{timestamp}'
+        with transaction.atomic(using=self.using):
+            chain_head, _ = self.chain_head_model.objects.using(
+                self.using).select_for_update().get_or_create(
+                    device_id=self.device_id,
+                    site_code=str(self.site_code),
+                    using=self.using or 'default')
+            self.check_watermark()
+            prev_batch_id = (
+                chain_head.batch_id or self.get_legacy_prev_batch_id(batch_id))
+            updated = self.update_pending(
+                batch_id=batch_id, prev_batch_id=prev_batch_id)
+            if updated:
+                chain_head.batch_id = batch_id
+                chain_head.save()
+                self.batch_id = batch_id
+                self.prev_batch_id = prev_batch_id
+                self.filename = f'{self.batch_id}{self.extension}'
+                self.create_history()
+
+    def get_legacy_prev_batch_id(self, batch_id=None):
+        """Returns the prev_batch_id from the history for hosts
+        that exported before the chain head was kept.
+
+        Called once, when the chain head is first created.
+        """
         history_obj = self.history_model.objects.using(self.using).last()
         if history_obj:
-            prev_batch_id = history_obj.batch_id
-        else:
-            obj = self.model.objects.using(self.using).filter(
-                is_consumed_server=True).last()
-            prev_batch_id = obj.batch_id if obj else batch_id
-        updated = self.model.objects.using(self.using).filter(
-            is_consumed_server=False).update(
-                batch_id=batch_id,
-                prev_batch_id=prev_batch_id)
-        if updated:
-            self.batch_id = batch_id
-            self.prev_batch_id = prev_batch_id
-            self.filename = f'{self.batch_id}.json'
-            self.create_history()
+            return history_obj.batch_id
+        obj = self.model.objects.using(self.using).filter(
+            is_consumed_server=True).last()
+        return obj.batch_id if obj else batch_id
+
+    @property
+    def watermark(self):
+        return self.watermark_model.objects.using(self.using).filter(
+            using=self.using or 'default').first()
+
+    @staticmethod
+    def behind(watermark=None):
+        """Returns a Q for transactions at or before the watermark.
+        """
+        if watermark.last_pk:
+            at = Q(created=watermark.last_created, pk__lte=watermark.last_pk)
+            return Q(created__lt=watermark.last_created) | at
+        return Q(created__lte=watermark.last_created)
+
+    @staticmethod
+    def after(watermark=None):
+        """Returns a Q for transactions after the watermark.
+        """
+        if watermark.last_pk:
+            at = Q(created=watermark.last_created, pk__gt=watermark.last_pk)
+            return Q(created__gt=watermark.last_created) | at
+        return Q(created__gt=watermark.last_created)
+
+    def check_watermark(self):
+        """Sets `full_scan` if there are pending transactions
+        behind the watermark.
+
+        Checked at most once per `watermark_check_interval`.
+        """
+        watermark = self.watermark
+        if self.full_scan or not watermark or not watermark.last_created:
+            return
+        now = get_utcnow()
+        checked = watermark.checked_datetime
+        if checked and now - checked < self.watermark_check_interval:
+            return
+        if self.model.objects.using(self.using).filter(
+                self.behind(watermark), is_consumed_server=False).exists():
+            logger.warning(
+                f'Found pending outgoing transactions behind the export '
+                f'watermark {watermark}. Selecting pending transactions '
+                f'with a full scan.')
+            self.full_scan = True
+        self.watermark_model.objects.using(self.using).filter(
+            pk=watermark.pk).update(checked_datetime=now)
+
+    @property
+    def pending(self):
+        """Returns a queryset of pending transactions after
+        the watermark.
+        """
+        pending = self.model.objects.using(self.using).filter(
+            is_consumed_server=False)
+        if not self.full_scan:
+            watermark = self.watermark
+            if watermark and watermark.last_created:
+                pending = pending.filter(self.after(watermark))
+        return pending
+
+    def update_pending(self, **values):
+        """Updates pending transactions, up to the limits if set,
+        with `values` and returns the number of rows updated.
+        """
+        pending = self.pending
+        if not self.max_count and not self.max_bytes:
+            last = pending.order_by('-created', '-pk').values_list(
+                'created', 'pk').first()
+            if last:
+                self.last_created, self.last_pk = last
+            return pending.update(**values)
+        updated = 0
+        pks = self.capped_pks(pending)
+        for index in range(0, len(pks), self.update_chunk_size):
+            updated += self.model.objects.using(self.using).filter(
+                pk__in=pks[index:index + self.update_chunk_size]).update(**values)
+        return updated
+
+    def capped_pks(self, queryset):
+        """Returns a list of pks of the oldest rows in the queryset
+        that fit within `max_count` and `max_bytes`.
+
+        Always includes at least one row.
+        """
+        pks = []
+        size = 0
+        rows = queryset.order_by('created', 'pk').annotate(
+            tx_size=Length('tx')).values_list('pk', 'created', 'tx_size')
+        for pk, created, tx_size in rows.iterator():
+            tx_size = tx_size or 0
+            if pks:
+                if self.max_count and len(pks) >= self.max_count:
+                    break
+                if self.max_bytes and size + tx_size > self.max_bytes:
+                    break
+            pks.append(pk)
+            size += tx_size
+            self.last_created, self.last_pk = created, pk
+        return pks
+
+    def update_watermark(self):
+        """Moves the watermark forward to the last transaction in
+        this batch.
+
+        A batch of transactions found behind the watermark does not
+        move it back.
+        """
+        if self.last_created:
+            watermark = self.watermark
+            last = (self.last_created, str(self.last_pk))
+            if watermark and watermark.last_created:
+                if (watermark.last_created, str(watermark.last_pk)) >= last:
+                    return
+            self.watermark_model.objects.using(self.using).update_or_create(
+                using=self.using or 'default',
+                defaults=dict(
+                    last_created=self.last_created,
+                    last_pk=self.last_pk))
 
     def close(self, remote_host=None):
         if self.closed:
@@ -119,6 +380,60 @@ class ExportBatch:
         self.history.exported_datetime = timestamp
         self.history.exported = True
         self.history.save()
+        self.update_watermark()
+
+    def coalesce(self):
+        """Flags the transactions between the first and last
+        transaction per (tx_name, tx_pk) as superseded and returns
+        the number of transactions superseded.
+
+        The first and last transactions for a record are exported in
+        their original positions so that transactions for other
+        records that depend on either, e.g. by foreign key, are
+        still applied in order on the remote host.
+
+        If a record is inserted and deleted within the batch, all of
+        its transactions are superseded since the record never
+        reached the remote host.
+
+        Superseded transactions are not exported but are closed
+        with the batch. If every transaction would be superseded,
+        none are, so the batch still reaches the remote host and
+        the batch sequence is not broken.
+        """
+        if self.closed:
+            raise BatchClosed('Batch is closed')
+        count = 0
+        first = {}
+        last = {}
+        rows = self.items.order_by('created', 'timestamp').values_list(
+            'pk', 'tx_name', 'tx_pk', 'action')
+        for pk, tx_name, tx_pk, action in rows.iterator():
+            count += 1
+            key = (tx_name, tx_pk)
+            if key not in first:
+                first[key] = (pk, action)
+            elif last[key] != first[key][0]:
+                self.superseded.add(last[key])
+            last[key] = pk
+            if action == DELETE and first[key][1] == INSERT:
+                self.superseded.update([first[key][0], pk])
+                del first[key]
+                del last[key]
+        if len(self.superseded) == count:
+            self.superseded = set()
+        if self.history:
+            self.history.coalesced = len(self.superseded)
+        return len(self.superseded)
+
+    def iterator(self, chunk_size=None):
+        """Returns a generator of the transactions to export.
+        """
+        if self.batch_id:
+            for obj in self.items.order_by('created', 'timestamp').iterator(
+                    chunk_size=chunk_size):
+                if obj.pk not in self.superseded:
+                    yield obj
 
     @property
     def items(self):
@@ -157,7 +472,15 @@ class TransactionExporter:
     model = OutgoingTransaction
     history_model = ExportedTransactionFileHistory
 
-    def __init__(self, export_path=None, using=None, **kwargs):
+    def __init__(self, export_path=None, using=None, chunk_size=None,
+                 max_count=None, max_bytes=None, compression=None,
+                 full_scan=None, coalesce=None, **kwargs):
+        self.chunk_size = chunk_size
+        self.coalesce = coalesce
+        self.compression = compression
+        self.full_scan = full_scan
+        self.max_bytes = max_bytes
+        self.max_count = max_count
         self.path = export_path
         self.serialize = serialize
         self.using = using
@@ -166,13 +489,33 @@ class TransactionExporter:
         """Returns a batch instance after exporting a batch of txs.
         """
         batch = self.batch_cls(
-            model=self.model, history_model=self.history_model, using=self.using)
-        if batch.items:
+            model=self.model, history_model=self.history_model, using=self.using,
+            max_count=self.max_count, max_bytes=self.max_bytes,
+            compression=self.compression, full_scan=self.full_scan)
+        if batch.batch_id:
+            if self.coalesce:
+                batch.coalesce()
             try:
-                json_file = self.json_file_cls(batch=batch, path=self.path)
+                json_file = self.json_file_cls(
+                    batch=batch, path=self.path, chunk_size=self.chunk_size)
                 json_file.write()
             except JSONDumpFileError as e:
                 raise TransactionExporterError(e)
             batch.close()
             return batch
         return None
+
+    def export_batches(self):
+        """Returns a list of batch instances after exporting all
+        pending txs.
+
+        If the batch size is capped, pending txs are exported to
+        as many files as needed, in order, each batch's `prev_batch_id`
+        pointing to the batch before it.
+        """
+        batches = []
+        batch = self.export_batch()
+        while batch:
+            batches.append(batch)
+            batch = self.export_batch()
+        return batches
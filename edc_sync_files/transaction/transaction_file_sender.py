@@ -1,8 +1,15 @@
+import logging
+import queue
+
+from concurrent.futures import ThreadPoolExecutor
 from edc_base.utils import get_utcnow
 
-from ..ssh_client import SSHClient, SSHClientError
+from ..ssh_client import SSHClient, SSHClientError, ssh_connection_pool
 from ..sftp_client import SFTPClient, SFTPClientError
 from .file_archiver import FileArchiver
+from .manifest import Manifest, ManifestError
+
+logger = logging.getLogger('edc_sync_files')
 
 
 class TransactionFileSenderError(Exception):
@@ -11,10 +18,32 @@ class TransactionFileSenderError(Exception):
 
 class TransactionFileSender:
 
+    """Sends files to the remote host over SFTP.
+
+    If persistent, the SSH connection is taken from the process-wide
+    connection pool and left open for the next call instead of
+    connecting for each call.
+
+    If channels is more than one, files are uploaded in parallel
+    on that many SFTP channels of the one SSH connection. Files are
+    still renamed into dst_path, archived and marked as sent one at
+    a time in the order given.
+
+    If skip_delivered, files already in dst_path on the remote host,
+    for example from a run that failed before updating history, are
+    not sent again but are archived and marked as sent.
+    """
+
+    connection_pool = ssh_connection_pool
+
     def __init__(self, remote_host=None, username=None, src_path=None, dst_tmp=None,
                  dst_path=None, archive_path=None, history_model=None, using=None,
-                 update_history_model=None, media_path=None, media_tmp=None, media_dst=None, **kwargs):
+                 update_history_model=None, media_path=None, media_tmp=None, media_dst=None,
+                 persistent=None, channels=None, skip_delivered=None, **kwargs):
         self.using = using
+        self.persistent = persistent
+        self.channels = channels or 1
+        self.skip_delivered = True if skip_delivered is None else skip_delivered
         self.media_path = media_path
         self.media_dst = media_dst
         self.media_tmp = media_tmp
@@ -30,35 +59,159 @@ class TransactionFileSender:
     def send(self, filenames=None):
         """Sends the file to the remote host and archives the sent file locally.
         """
-        try:
-            with self.ssh_client.connect() as ssh_conn:
-                with self.sftp_client.connect(ssh_conn) as sftp_conn:
-                    for filename in filenames:
-                        sftp_conn.copy(filename=filename)
-                        self.archive(filename=filename)
-                        if self.update_history_model:
-                            self.update_history(filename=filename)
-        except SSHClientError as e:
-            raise TransactionFileSenderError(e) from e
-        except SFTPClientError as e:
-            raise TransactionFileSenderError(e) from e
+        self.copy(sftp_client=self.sftp_client,
+                  filenames=filenames, on_copied=self.sent)
         return filenames
 
     def send_media(self, filenames=None):
         sftp_client = SFTPClient(
             src_path=self.media_path, dst_tmp=self.media_tmp, dst_path=self.media_dst)
-        try:
-            with self.ssh_client.connect() as ssh_conn:
-                with sftp_client.connect(ssh_conn) as sftp_conn:
-                    for filename in filenames:
-                        sftp_conn.copy(filename=filename)
-                        self.update_media_log(filename)
-        except SSHClientError as e:
-            raise TransactionFileSenderError(e) from e
-        except SFTPClientError as e:
-            raise TransactionFileSenderError(e) from e
+        self.copy(sftp_client=sftp_client,
+                  filenames=filenames, on_copied=self.update_media_log)
         return filenames
 
+    def connect(self):
+        """Returns a connected SSH client.
+        """
+        if self.persistent:
+            return self.connection_pool.connect(self.ssh_client)
+        return self.ssh_client.connect()
+
+    def close(self):
+        """Closes the pooled connection, if any.
+        """
+        self.connection_pool.discard(self.ssh_client)
+
+    def copy(self, sftp_client=None, filenames=None, on_copied=None):
+        """Copies each file to the remote host and calls on_copied
+        with the filename.
+
+        If persistent and the pooled connection dies while copying,
+        reconnects once and copies the remaining files.
+        """
+        filenames = list(filenames)
+        reconnected = False
+        while True:
+            try:
+                ssh_conn = self.connect()
+                sftp_conn = sftp_client.connect(ssh_conn)
+            except SSHClientError as e:
+                raise TransactionFileSenderError(e) from e
+            try:
+                self.copy_files(
+                    ssh_conn=ssh_conn, sftp_conn=sftp_conn,
+                    filenames=filenames, on_copied=on_copied)
+            except SFTPClientError as e:
+                if reconnected or not self.discard_dead(ssh_conn):
+                    raise TransactionFileSenderError(e) from e
+                reconnected = True
+            else:
+                return
+            finally:
+                if not self.persistent:
+                    sftp_conn.close()
+                    ssh_conn.close()
+
+    def copy_files(self, ssh_conn=None, sftp_conn=None, filenames=None,
+                   on_copied=None):
+        """Copies the files not already delivered, calls on_copied
+        with each filename and removes it from filenames.
+        """
+        delivered = self.get_delivered(sftp_conn=sftp_conn, filenames=filenames)
+        if self.channels > 1 and len(filenames) > 1:
+            self.copy_concurrently(
+                ssh_conn=ssh_conn, sftp_conn=sftp_conn,
+                filenames=filenames, on_copied=on_copied,
+                delivered=delivered)
+        else:
+            while filenames:
+                if filenames[0] not in delivered:
+                    sftp_conn.copy(filename=filenames[0])
+                on_copied(filenames.pop(0))
+
+    def discard_dead(self, ssh_conn=None):
+        """Returns True if the pooled connection died, after
+        closing it so the next connect opens a new one.
+        """
+        dead = self.persistent and not ssh_conn.connected
+        if dead:
+            self.close()
+        return dead
+
+    def get_delivered(self, sftp_conn=None, filenames=None):
+        """Returns the set of filenames already delivered to the
+        remote host, if skip_delivered.
+
+        Lists the remote folders once for all the filenames.
+        """
+        delivered = set()
+        if self.skip_delivered:
+            sftp_conn.scan()
+            for filename in filenames:
+                if sftp_conn.delivered(
+                        filename=filename,
+                        sha256=self.get_sha256(sftp_conn=sftp_conn, filename=filename)):
+                    logger.info(f'{filename} already on remote host. Not sending.')
+                    delivered.add(filename)
+        return delivered
+
+    def get_sha256(self, sftp_conn=None, filename=None):
+        """Returns the sha256 from the file's manifest or None.
+        """
+        try:
+            manifest = Manifest.read(path=sftp_conn.src_path, filename=filename)
+        except ManifestError:
+            return None
+        return manifest.sha256
+
+    def copy_concurrently(self, ssh_conn=None, sftp_conn=None, filenames=None,
+                          on_copied=None, delivered=None):
+        """Uploads files in parallel on separate SFTP channels then,
+        in the order given, renames each on sftp_conn, calls
+        on_copied and removes the filename from filenames.
+
+        Files in delivered are not uploaded or renamed.
+
+        Files uploaded but not renamed are left in dst_tmp.
+        """
+        channels = queue.Queue()
+        opened = []
+
+        def upload(filename):
+            channel = channels.get()
+            try:
+                channel.upload(filename=filename)
+            finally:
+                channels.put(channel)
+
+        delivered = delivered or set()
+        pending = [f for f in filenames if f not in delivered]
+        try:
+            for _ in range(min(self.channels, len(pending))):
+                channel = sftp_conn.open_channel(ssh_conn)
+                opened.append(channel)
+                channels.put(channel)
+            with ThreadPoolExecutor(max_workers=max(len(opened), 1)) as executor:
+                futures = {filename: executor.submit(upload, filename)
+                           for filename in pending}
+                try:
+                    while filenames:
+                        if filenames[0] in futures:
+                            futures[filenames[0]].result()
+                            sftp_conn.commit(filename=filenames[0])
+                        on_copied(filenames.pop(0))
+                finally:
+                    for future in futures.values():
+                        future.cancel()
+        finally:
+            for channel in opened:
+                channel.close()
+
+    def sent(self, filename=None):
+        self.archive(filename=filename)
+        if self.update_history_model:
+            self.update_history(filename=filename)
+
     def update_history(self, filename=None):
         try:
             obj = self.history_model.objects.using(
@@ -1,14 +1,22 @@
 import json
+import lzma
 import os
+import uuid
 
 from django.core.serializers.base import DeserializationError
+from django.core.serializers.python import Deserializer as PythonDeserializer
+from django.db import transaction
 from django.db.utils import IntegrityError
 
 from edc_base.utils import get_utcnow
 from edc_sync.models import IncomingTransaction
 from edc_sync.transaction import deserialize
 
-from ..models import ImportedTransactionFileHistory
+from ..models import ImportedTransactionFileCheckpoint, ImportedTransactionFileHistory
+from .batch_history_index import batch_history_index
+from .file_compression import get_compression, open_text
+from .json_array_reader import JSONArrayReader, JSONArrayReaderError
+from .manifest import Manifest, ManifestError
 
 
 class TransactionImporterError(Exception):
@@ -40,19 +48,43 @@ class BatchDeserializationError(Exception):
 
 
 class InvalidBatchSequence(Exception):
-    pass
+
+    def __init__(self, message=None, batch_id=None, prev_batch_id=None):
+        super().__init__(message)
+        self.batch_id = batch_id
+        self.prev_batch_id = prev_batch_id
 
 
 class JSONFileError(Exception):
     pass
 
 
+class CheckpointError(JSONFileError):
+    pass
+
+
 class JSONLoadFile:
 
-    def __init__(self, name=None, path=None, **kwargs):
+    """A transaction file to be deserialized.
+
+    If `incremental` (default), objects are parsed from the file
+    stream and deserialized one at a time instead of reading and
+    parsing the whole file up front.
+
+    If `offset`, an incremental file yields the first object then
+    skips to the object at `offset` without deserializing the
+    objects in between. The object before `offset` must have
+    primary key `last_pk`.
+    """
+
+    def __init__(self, name=None, path=None, incremental=None, offset=None,
+                 last_pk=None, **kwargs):
         self._deserialized_objects = None
         self.deserialize = deserialize
+        self.incremental = True if incremental is None else incremental
+        self.last_pk = last_pk
         self.name = name
+        self.offset = offset or 0
         self.path = path
 
     def __str__(self):
@@ -63,55 +95,107 @@ class JSONLoadFile:
 
     def read(self):
         """Returns the file contents as validated JSON text.
+
+        Compressed files are decompressed as they are read.
         """
         p = os.path.join(self.path, self.name)
         try:
-            with open(p) as f:
+            with open_text(p, compression=get_compression(self.name)) as f:
                 json_text = f.read()
-        except FileNotFoundError as e:
-            raise JSONFileError(e) from e
+        except (OSError, EOFError, lzma.LZMAError) as e:
+            raise JSONFileError(f'{e} Got {p}') from e
         try:
             json.loads(json_text)
         except (json.JSONDecodeError, TypeError) as e:
             raise JSONFileError(f'{e} Got {p}') from e
         return json_text
 
+    def iter_objects(self):
+        """Returns a generator of the python objects in the
+        file's top-level JSON array, parsed incrementally.
+        """
+        p = os.path.join(self.path, self.name)
+        try:
+            with open_text(p, compression=get_compression(self.name)) as f:
+                index = -1
+                for index, obj in enumerate(JSONArrayReader(stream=f)):
+                    if index == self.offset - 1 and not self.is_last_pk(obj):
+                        raise CheckpointError(
+                            f'Object at offset {index} does not match '
+                            f'last_pk {self.last_pk}. Got {p}')
+                    if index == 0 or index >= self.offset:
+                        yield obj
+                if index < self.offset - 1:
+                    raise CheckpointError(
+                        f'File ends before offset {self.offset}. Got {p}')
+        except JSONArrayReaderError as e:
+            raise JSONFileError(f'{e} Got {p}') from e
+        except (OSError, EOFError, lzma.LZMAError) as e:
+            raise JSONFileError(f'{e} Got {p}') from e
+
+    def is_last_pk(self, obj=None):
+        try:
+            return uuid.UUID(str(obj.get('pk'))) == uuid.UUID(str(self.last_pk))
+        except (AttributeError, ValueError):
+            return False
+
     @property
     def deserialized_objects(self):
         """Returns a generator of deserialized objects.
         """
         if not self._deserialized_objects:
-            json_text = self.read()
-            self._deserialized_objects = self.deserialize(
-                json_text=json_text)
+            if self.incremental:
+                self._deserialized_objects = iter(PythonDeserializer(
+                    self.iter_objects(),
+                    ensure_ascii=True,
+                    use_natural_foreign_keys=True,
+                    use_natural_primary_keys=False))
+            else:
+                json_text = self.read()
+                self._deserialized_objects = self.deserialize(
+                    json_text=json_text)
         return self._deserialized_objects
 
 
 class BatchHistory:
 
-    def __init__(self, model=None):
+    """Imported batch history.
+
+    Lookups are answered by the process-wide batch history index
+    when loaded, otherwise by query.
+    """
+
+    def __init__(self, model=None, index=None):
         self.model = model or ImportedTransactionFileHistory
+        self.index = index or batch_history_index
 
     def exists(self, batch_id=None):
         """Returns True if batch_id exists in the history.
         """
-        try:
-            self.model.objects.get(batch_id=batch_id)
-        except self.model.DoesNotExist:
-            return False
-        return True
+        if self.index.contains(batch_id=batch_id):
+            return True
+        return self.model.objects.filter(batch_id=batch_id).exists()
+
+    def is_next(self, batch_id=None, prev_batch_id=None):
+        """Returns True if the index shows batch_id is the next,
+        unprocessed, batch after prev_batch_id.
+        """
+        return self.index.is_next(
+            batch_id=batch_id, prev_batch_id=prev_batch_id)
 
     def close(self, batch_id):
         obj = self.model.objects.get(batch_id=batch_id)
         obj.consumed = True
         obj.consumed_datetime = get_utcnow()
         obj.save()
+        transaction.on_commit(
+            lambda: self.index.add(
+                batch_id=obj.batch_id, prev_batch_id=obj.prev_batch_id))
 
     def update(self, filename=None, batch_id=None, prev_batch_id=None,
                producer=None, count=None):
         """Creates an history model instance.
         """
-        # TODO: refactor model enforce unique batch_id
         # TODO: refactor model to not allow NULLs
         if not filename:
             raise BatchHistoryError('Invalid filename. Got None')
@@ -121,30 +205,85 @@ class BatchHistory:
             raise BatchHistoryError('Invalid prev_batch_id. Got None')
         if not producer:
             raise BatchHistoryError('Invalid producer. Got None')
-        if self.exists(batch_id=batch_id):
+        is_next = self.is_next(batch_id=batch_id, prev_batch_id=prev_batch_id)
+        if not is_next and self.exists(batch_id=batch_id):
             raise IntegrityError('Duplicate batch_id')
+        obj = self.model(
+            filename=filename,
+            batch_id=batch_id,
+            prev_batch_id=prev_batch_id,
+            producer=producer,
+            total=count)
+        obj.transaction_file.name = filename
+        obj.save()
+        transaction.on_commit(
+            lambda: self.index.add(
+                batch_id=batch_id, prev_batch_id=prev_batch_id))
+        return obj
+
+
+class ImportCheckpoint:
+
+    """Import checkpoints, the number of objects of a file committed
+    and the pk of the last one.
+    """
+
+    def __init__(self, model=None):
+        self.model = model or ImportedTransactionFileCheckpoint
+
+    def get(self, filename=None):
+        """Returns the checkpoint for the file or None.
+        """
         try:
-            obj = self.model.objects.get(batch_id=batch_id)
+            return self.model.objects.get(filename=filename)
         except self.model.DoesNotExist:
-            obj = self.model(
-                filename=filename,
-                batch_id=batch_id,
-                prev_batch_id=prev_batch_id,
-                producer=producer,
-                total=count)
-            obj.transaction_file.name = filename
-            obj.save()
+            return None
+
+    def update(self, filename=None, batch_id=None, offset=None, last_pk=None):
+        obj, _ = self.model.objects.update_or_create(
+            filename=filename,
+            defaults=dict(batch_id=batch_id, offset=offset, last_pk=last_pk))
         return obj
 
+    def delete(self, filename=None):
+        self.model.objects.filter(filename=filename).delete()
+
+    def discard(self, filename=None):
+        """Deletes the checkpoint of a file that will not be imported
+        and the incoming transactions committed from the file.
+        """
+        checkpoint = self.get(filename=filename)
+        if checkpoint:
+            with transaction.atomic():
+                if checkpoint.batch_id:
+                    histories = ImportedTransactionFileHistory.objects.filter(
+                        batch_id=checkpoint.batch_id)
+                    if not histories.exists():
+                        IncomingTransaction.objects.filter(
+                            batch_id=checkpoint.batch_id).delete()
+                checkpoint.delete()
+
 
 class ImportBatch:
 
-    def __init__(self, **kwargs):
+    chunk_size = 500
+
+    # (self.model, source model class): list of attnames copied to self.model
+    field_plans = {}
+
+    def __init__(self, chunk_size=None, keep_saved=None, **kwargs):
         self._valid_sequence = None
+        self.chunk_size = chunk_size or self.chunk_size
+        # model instances inserted by `save`, if kept
+        self.saved_objects = [] if keep_saved else None
+        self.inserted = None
+        self.existing = None
+        self.total = None
         self.filename = None
         self.batch_id = None
         self.prev_batch_id = None
         self.producer = None
+        self.manifest = None
         self.objects = []
         self.batch_history = BatchHistory()
         self.model = IncomingTransaction
@@ -177,12 +316,115 @@ class ImportBatch:
         except JSONFileError as e:
             raise BatchDeserializationError(e) from e
 
+    def save_chunked(self, deserialized_txs=None, filename=None, offset=None,
+                     checkpoint=None):
+        """Saves unsaved model instances from a generator of
+        deserialized objects in chunks of `chunk_size` and returns
+        the number inserted.
+
+        Objects are not kept in self.objects so memory does not
+        grow with the size of the file. Call in a transaction to
+        save all or nothing.
+
+        If `checkpoint`, each chunk is committed with an updated
+        checkpoint instead. If `offset`, the generator is expected to
+        yield the first object, for `peek`, then the object at
+        `offset`, see JSONLoadFile.
+        """
+        self.filename = filename
+        if not self.filename:
+            raise BatchError('Invalid filename. Got None')
+        self.inserted = 0
+        self.existing = offset or 0
+        self.total = offset or 0
+        self.saved_objects = None
+        chunk = []
+        try:
+            for deserialized_tx in self.resume(deserialized_txs, offset=offset):
+                chunk.append(deserialized_tx.object)
+                if len(chunk) == self.chunk_size:
+                    self.commit_chunk(chunk, checkpoint=checkpoint)
+                    chunk = []
+        except DeserializationError as e:
+            raise BatchDeserializationError(e) from e
+        except JSONFileError as e:
+            raise BatchDeserializationError(e) from e
+        if chunk:
+            self.commit_chunk(chunk, checkpoint=checkpoint)
+        if not self.total:
+            raise BatchError(
+                'Failed to save batch. There are no objects to add.')
+        return self.inserted
+
+    def resume(self, deserialized_txs=None, offset=None):
+        """Returns a generator of the deserialized objects to save
+        after peeking at the first.
+
+        If `offset`, the first object is not saved again.
+        """
+        for index, deserialized_tx in enumerate(deserialized_txs):
+            if index == 0:
+                self.peek(deserialized_tx)
+                if offset:
+                    continue
+            yield deserialized_tx
+
+    def commit_chunk(self, objects=None, checkpoint=None):
+        """Saves the chunk and, if `checkpoint`, commits it with
+        the updated checkpoint.
+        """
+        if not checkpoint:
+            self.save_chunk(objects)
+            self.total += len(objects)
+        else:
+            with transaction.atomic():
+                self.save_chunk(objects)
+                checkpoint.update(
+                    filename=self.filename,
+                    batch_id=self.batch_id,
+                    offset=self.total + len(objects),
+                    last_pk=objects[-1].pk)
+            self.total += len(objects)
+
     def peek(self, deserialized_tx):
         """Peeks into first tx and sets self attrs or raise.
+
+        If the batch was validated from a manifest, only checks the
+        first tx matches the manifest.
+        """
+        obj = deserialized_tx.object
+        if self.manifest:
+            ids = (obj.batch_id, obj.prev_batch_id)
+            if ids != (self.batch_id, self.prev_batch_id):
+                raise BatchError(
+                    f'Batch does not match manifest. Got file=\'{self.filename}\', '
+                    f'batch_id={obj.batch_id}, prev_batch_id={obj.prev_batch_id}.')
+        else:
+            self.validate(
+                batch_id=obj.batch_id,
+                prev_batch_id=obj.prev_batch_id,
+                producer=obj.producer)
+
+    def peek_manifest(self, manifest=None):
+        """Sets self attrs from the manifest or raise, without
+        reading the file.
+        """
+        self.manifest = manifest
+        self.validate(
+            batch_id=manifest.batch_id,
+            prev_batch_id=manifest.prev_batch_id,
+            producer=manifest.producer)
+
+    def validate(self, batch_id=None, prev_batch_id=None, producer=None):
+        """Sets self attrs or raises if the batch has already been
+        processed or is out of sequence.
         """
-        self.batch_id = deserialized_tx.object.batch_id
-        self.prev_batch_id = deserialized_tx.object.prev_batch_id
-        self.producer = deserialized_tx.object.producer
+        self.batch_id = batch_id
+        self.prev_batch_id = prev_batch_id
+        self.producer = producer
+        if self.batch_history.is_next(
+                batch_id=self.batch_id, prev_batch_id=self.prev_batch_id):
+            return
         if self.batch_history.exists(batch_id=self.batch_id):
             raise BatchAlreadyProcessed(
                 f'Batch {self.batch_id} has already been processed')
@@ -191,31 +433,71 @@ class ImportBatch:
                 raise InvalidBatchSequence(
                     f'Invalid import sequence. History does not exist for prev_batch_id. '
                     f'Got file=\'{self.filename}\', prev_batch_id='
-                    f'{self.prev_batch_id}, batch_id={self.batch_id}.')
+                    f'{self.prev_batch_id}, batch_id={self.batch_id}.',
+                    batch_id=self.batch_id,
+                    prev_batch_id=self.prev_batch_id)
 
     def save(self):
-        """Saves all model instances in the batch as model.
+        """Saves all model instances in the batch as model and
+        returns the number inserted.
+
+        Objects that already exist are skipped. Missing objects are
+        inserted with `bulk_create` in one database transaction.
         """
-        saved = 0
         if not self.objects:
             raise BatchError('Save failed. Batch is empty')
-        for deserialized_tx in self.objects:
-            try:
-                self.model.objects.get(pk=deserialized_tx.pk)
-            except self.model.DoesNotExist:
-                data = {}
-                for field in self.model._meta.get_fields():
-                    try:
-                        data.update({field.name: getattr(
-                            deserialized_tx, field.name)})
-                    except AttributeError:
-                        pass
-                self.model.objects.create(**data)
-                saved += 1
-        return saved
+        self.inserted = 0
+        self.existing = 0
+        with transaction.atomic():
+            for index in range(0, len(self.objects), self.chunk_size):
+                instances = self.save_chunk(
+                    self.objects[index:index + self.chunk_size])
+                if self.saved_objects is not None:
+                    self.saved_objects.extend(instances)
+        return self.inserted
+
+    def save_chunk(self, objects=None):
+        """Inserts the objects in the chunk that do not already exist.
+        """
+        pks = [obj.pk for obj in objects]
+        existing = set(
+            str(pk) for pk in self.model.objects.filter(
+                pk__in=pks).values_list('pk', flat=True))
+        instances = []
+        for obj in objects:
+            if str(obj.pk) in existing:
+                self.existing += 1
+            else:
+                existing.add(str(obj.pk))
+                instances.append(self.to_model(obj))
+        self.model.objects.bulk_create(instances)
+        self.inserted += len(instances)
+        return instances
+
+    def to_model(self, obj=None):
+        """Returns an unsaved instance of self.model with field
+        values copied from obj.
+        """
+        return self.model(
+            **{attname: getattr(obj, attname)
+               for attname in self.get_field_plan(obj.__class__)})
+
+    def get_field_plan(self, model_cls=None):
+        """Returns the attnames of self.model that can be copied from
+        instances of model_cls.
+        """
+        key = (self.model, model_cls)
+        try:
+            return self.field_plans[key]
+        except KeyError:
+            attnames = [f.attname for f in model_cls._meta.concrete_fields]
+            plan = [f.attname for f in self.model._meta.concrete_fields
+                    if f.attname in attnames]
+            self.field_plans[key] = plan
+            return plan
 
     def update_history(self):
-        if not self.objects:
+        if not self.count:
             raise BatchIsEmpty('Update history failed. Batch is empty')
         if self.objects_unsaved:
             raise BatchUnsaved(
@@ -225,7 +507,7 @@ class ImportBatch:
             batch_id=self.batch_id,
             prev_batch_id=self.prev_batch_id,
             producer=self.producer,
-            count=self.saved_transactions.count())
+            count=self.saved_count)
 
     @property
     def saved_transactions(self):
@@ -233,17 +515,28 @@ class ImportBatch:
         """
         return self.model.objects.filter(batch_id=self.batch_id)
 
+    @property
+    def saved_count(self):
+        """Returns the number of batch objects saved, counted by
+        `save` or, if not saved by this instance, by query.
+        """
+        if self.inserted is None:
+            return self.saved_transactions.count()
+        return self.inserted + self.existing
+
     @property
     def count(self):
         """Returns the number of objects in the batch.
         """
+        if self.total is not None:
+            return self.total
         return len(self.objects)
 
     @property
     def objects_unsaved(self):
         """Returns True if any batch objects have not been saved.
         """
-        return self.count > self.saved_transactions.count()
+        return self.count > self.saved_count
 
     def close(self):
         self.batch_history.close(self.batch_id)
@@ -251,29 +544,124 @@ class ImportBatch:
 
 class TransactionImporter:
     """Imports transactions from a file as incoming transaction.
+
+    If the file has a manifest, the batch sequence, size and checksum
+    are validated from the manifest before the file is parsed.
+
+    If `chunked`, objects are saved in chunks as they are read from
+    the file in one database transaction, see ImportBatch.save_chunked.
+
+    If `checkpoints`, objects are saved in chunks and each chunk is
+    committed with a checkpoint. An interrupted import resumes from
+    the checkpoint. The file is no longer saved all or nothing, but
+    its history is only created once all objects are saved. Checkpoints
+    need autocommit, do not import in an outer database transaction.
     """
     batch_cls = ImportBatch
+    checkpoint_cls = ImportCheckpoint
     json_file_cls = JSONLoadFile
+    manifest_cls = Manifest
 
-    def __init__(self, import_path=None, **kwargs):
+    def __init__(self, import_path=None, chunked=None, chunk_size=None,
+                 checkpoints=None, keep_saved=None, **kwargs):
         self.path = import_path
+        self.chunked = chunked
+        self.chunk_size = chunk_size
+        self.keep_saved = keep_saved
+        self.checkpoint = self.checkpoint_cls() if checkpoints else None
 
     def import_batch(self, filename):
         """Imports the batch of outgoing transactions into
         model IncomingTransaction.
         """
-        batch = self.batch_cls()
+        batch = self.batch_cls(
+            chunk_size=self.chunk_size, keep_saved=self.keep_saved)
+        try:
+            manifest = self.manifest_cls.read(path=self.path, filename=filename)
+            if manifest:
+                batch.filename = filename
+                batch.peek_manifest(manifest)
+                manifest.verify(path=self.path)
+        except (ManifestError, InvalidBatchSequence, BatchAlreadyProcessed) as e:
+            raise TransactionImporterError(e) from e
+        if self.checkpoint:
+            return self.import_from_checkpoint(
+                batch=batch, filename=filename, manifest=manifest)
         json_file = self.json_file_cls(name=filename, path=self.path)
         try:
             deserialized_txs = json_file.deserialized_objects
         except JSONFileError as e:
             raise TransactionImporterError(e) from e
+        if self.chunked:
+            with transaction.atomic():
+                self.save_chunked(
+                    batch=batch, deserialized_txs=deserialized_txs,
+                    filename=json_file.name, manifest=manifest)
+                batch.update_history()
+            return batch
         try:
             batch.populate(
                 deserialized_txs=deserialized_txs,
                 filename=json_file.name)
-        except (BatchDeserializationError, InvalidBatchSequence, BatchAlreadyProcessed) as e:
+        except (BatchError, BatchDeserializationError, InvalidBatchSequence,
+                BatchAlreadyProcessed) as e:
             raise TransactionImporterError(e) from e
+        self.verify_count(batch=batch, manifest=manifest)
         batch.save()
         batch.update_history()
         return batch
+
+    def import_from_checkpoint(self, batch=None, filename=None, manifest=None):
+        """Imports the file in chunks resuming from the file's
+        checkpoint, if any.
+
+        If the checkpoint does not match the file, the checkpoint
+        is deleted and an exception raised.
+        """
+        checkpoint = self.checkpoint.get(filename=filename)
+        json_file = self.json_file_cls(
+            name=filename, path=self.path,
+            offset=checkpoint.offset if checkpoint else None,
+            last_pk=checkpoint.last_pk if checkpoint else None)
+        try:
+            deserialized_txs = json_file.deserialized_objects
+        except JSONFileError as e:
+            raise TransactionImporterError(e) from e
+        try:
+            self.save_chunked(
+                batch=batch, deserialized_txs=deserialized_txs,
+                filename=json_file.name, manifest=manifest,
+                offset=json_file.offset, checkpoint=self.checkpoint)
+        except TransactionImporterError as e:
+            cause = e.__cause__
+            while cause and not isinstance(cause, CheckpointError):
+                cause = cause.__cause__
+            if cause:
+                self.checkpoint.delete(filename=filename)
+            raise
+        with transaction.atomic():
+            batch.update_history()
+            self.checkpoint.delete(filename=filename)
+        return batch
+
+    def discard(self, filename=None):
+        """Discards the checkpoint, if any, of a file that failed
+        and will not be imported.
+        """
+        self.checkpoint_cls().discard(filename=filename)
+
+    def save_chunked(self, batch=None, deserialized_txs=None, filename=None,
+                     manifest=None, **kwargs):
+        try:
+            batch.save_chunked(
+                deserialized_txs=deserialized_txs, filename=filename, **kwargs)
+        except (BatchError, BatchDeserializationError, InvalidBatchSequence,
+                BatchAlreadyProcessed) as e:
+            raise TransactionImporterError(e) from e
+        self.verify_count(batch=batch, manifest=manifest)
+
+    def verify_count(self, batch=None, manifest=None):
+        if manifest and batch.count != manifest.count:
+            raise TransactionImporterError(
+                f'Batch count does not match manifest. Expected {manifest.count}. '
+                f'Got {batch.count}. See {batch.filename}.')